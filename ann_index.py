@@ -0,0 +1,106 @@
+#ann_index.py
+import math
+import numpy as np
+from typing import Optional, Tuple
+from config import ANN_N_LISTS, ANN_N_PROBE
+from retrieval import normalize_rows, top_k
+
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 256  # Vecteurs échantillonnés par liste pour entraîner les centroïdes
+
+
+class IVFFlatIndex:
+    """
+    Index IVF-flat en NumPy pur pour la similarité cosinus : les vecteurs normalisés sont répartis
+    en `n_lists` listes par k-means sphérique, et une requête ne score que les `n_probe` listes
+    dont les centroïdes sont les plus proches.
+    """
+    def __init__(self, n_lists: Optional[int] = ANN_N_LISTS, n_probe: int = ANN_N_PROBE, seed: int = 0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.seed = seed
+        self.centroids = None
+        self.vectors = None   # Vecteurs normalisés, triés par liste
+        self.ids = None       # Identifiant (ligne d'origine) de chaque vecteur trié
+        self.offsets = None   # Liste l -> vecteurs[offsets[l]:offsets[l + 1]]
+
+    def __len__(self) -> int:
+        return 0 if self.ids is None else len(self.ids)
+
+    def _train(self, matrix: np.ndarray, n_lists: int) -> np.ndarray:
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(matrix), n_lists * KMEANS_SAMPLE_PER_LIST)
+        sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            empty = np.bincount(assignments, minlength=n_lists) == 0
+            # Une liste vide reprend un point au hasard plutôt que de rester inutilisée
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def build(self, matrix: np.ndarray, ids: Optional[np.ndarray] = None) -> 'IVFFlatIndex':
+        """Construit l'index sur les lignes de `matrix` (normalisées ici) ; `ids` vaut par défaut 0..N-1."""
+        matrix = normalize_rows(matrix)
+        ids = np.arange(len(matrix)) if ids is None else np.asarray(ids)
+        n_lists = self.n_lists or max(1, int(math.sqrt(len(matrix))))
+        n_lists = max(1, min(n_lists, len(matrix)))
+        self.centroids = self._train(matrix, n_lists)
+        assignments = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), 65536):
+            assignments[start:start + 65536] = np.argmax(matrix[start:start + 65536] @ self.centroids.T, axis=1)
+        order = np.argsort(assignments, kind='stable')
+        self.vectors = matrix[order]
+        self.ids = ids[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))])
+        self.n_lists = n_lists
+        return self
+
+    def search(self, query_matrix: np.ndarray, k: int, n_probe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Les k meilleurs (ids, scores) de chaque requête, par score décroissant.
+        Si les listes visitées contiennent moins de k vecteurs, les places restantes valent -1 / -inf.
+        """
+        query_matrix = normalize_rows(np.atleast_2d(query_matrix))
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        probes, _ = top_k(query_matrix @ self.centroids.T, n_probe)
+        result_ids = np.full((len(query_matrix), k), -1, dtype=np.int64)
+        result_scores = np.full((len(query_matrix), k), -np.inf, dtype=np.float32)
+        for q, lists in enumerate(probes):
+            rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+            if len(rows) == 0:
+                continue
+            scores = self.vectors[rows] @ query_matrix[q]
+            positions, best_scores = top_k(scores[None, :], k)
+            result_ids[q, :positions.shape[1]] = self.ids[rows[positions[0]]]
+            result_scores[q, :positions.shape[1]] = best_scores[0]
+        return result_ids, result_scores
+
+    def save(self, path: str):
+        np.savez(
+            path, centroids=self.centroids, vectors=self.vectors, ids=self.ids, offsets=self.offsets,
+            params=np.array([self.n_lists, self.n_probe, self.seed])
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'IVFFlatIndex':
+        data = np.load(path if path.endswith('.npz') else path + '.npz')
+        n_lists, n_probe, seed = (int(value) for value in data['params'])
+        index = cls(n_lists=n_lists, n_probe=n_probe, seed=seed)
+        index.centroids = data['centroids']
+        index.vectors = data['vectors']
+        index.ids = data['ids']
+        index.offsets = data['offsets']
+        return index
+
+
+def recall_vs_exact(index: IVFFlatIndex, query_matrix: np.ndarray, corpus_matrix: np.ndarray, k: int = 10) -> float:
+    """Part des k plus proches voisins exacts retrouvés par l'index (recall@k de l'ANN), sur un échantillon de requêtes."""
+    query_matrix = normalize_rows(query_matrix)
+    exact, _ = top_k(query_matrix @ normalize_rows(corpus_matrix).T, k)
+    approx, _ = index.search(query_matrix, k)
+    found = sum(len(set(exact_row) & set(approx_row)) for exact_row, approx_row in zip(exact, approx))
+    return found / exact.size if exact.size else 1.0
@@ -16,6 +16,9 @@ RESULTS_DIR = os.path.join(OUTPUT_DIR, "results")
 OUTPUT_FILE = os.path.join(RESULTS_DIR, "technical_queries_results_all_folders.jsonl")
 RETRIEVAL_RESULTS_FILE = os.path.join(RESULTS_DIR, "retrieval_results_fixed.json")
 RANKED_RESULTS_FILE = os.path.join(RESULTS_DIR, "ranked_results.json")
+RANKED_RESULTS_JSONL = os.path.join(RESULTS_DIR, "ranked_results.jsonl")  # Sortie append-only du ranking
+EVALUATION_STATE_FILE = os.path.join(RESULTS_DIR, "evaluation_state.json")
+RERANK_CACHE_FILE = os.path.join(RESULTS_DIR, "rerank_cache.jsonl")  # Réponses de classement LLM déjà obtenues
 
 # API Keys
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
@@ -24,9 +27,96 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 VECTAPI_HOST_IMAGE = "https://lmspaul--mcdse-embeddings-image-embeddings.modal.run"
 VECTAPI_HOST_TEXT = "https://lmspaul--mcdse-embeddings-text-embeddings.modal.run"
 
+# Client d'embedding par lots
+EMBED_BATCH_SIZE = 16  # Nombre maximal d'éléments par requête
+EMBED_BATCH_MAX_BYTES = 8 * 1024 * 1024  # Taille maximale d'une requête (images ou textes)
+EMBED_POOL_SIZE = 10  # Connexions HTTP réutilisées
+EMBED_TIMEOUT = 120
+EMBED_MAX_CONCURRENCY = 8  # Requêtes d'embedding simultanées (client asynchrone)
+EMBED_REQUESTS_PER_SECOND = 20
+
+# Backend d'embedding de l'évaluation : "http" (services Modal), "local" (MCDSEModel en process) ou "fake"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "http")
+LOCAL_EMBED_MODEL_PATH = "marco/mcdse-2b-v1"
+LOCAL_EMBED_BATCH_SIZE = 4
+LOCAL_EMBED_THREADS = os.cpu_count() or 1  # Threads torch pour l'inférence CPU
+LOCAL_EMBED_DIMENSION = 1536
+LOCAL_EMBED_DEVICE = None  # None : cuda, mps ou cpu selon la machine
+
+# Cache local des embeddings (pages et requêtes), réutilisé d'une évaluation à l'autre
+USE_EMBEDDING_STORE = True
+EMBEDDING_STORE_DIR = os.path.join(OUTPUT_DIR, "embedding_store")
+EMBEDDING_STORE_DTYPE = "float16"  # "float16" ou "float32"
+
+# Recherche lors de l'évaluation et de la déduplication : "exact" (produit matriciel) ou "ann" (index IVF)
+RETRIEVAL_SEARCH = "exact"
+ANN_N_LISTS = None  # Nombre de listes de l'index IVF (None : ~sqrt(N))
+ANN_N_PROBE = 8  # Listes visitées par requête (plus élevé : meilleur rappel, plus lent)
+ANN_RANK_DEPTH = 100  # Profondeur de recherche ANN pour situer la page attendue
+
+# Négatifs difficiles de train.parquet (create_parquet) : pages les mieux scorées hors page positive
+HARD_NEGATIVES_PER_QUERY = 0  # 0 : pas de colonne neg
+HARD_NEGATIVE_DEPTH = 50  # Candidats examinés par requête avant filtrage
+HARD_NEGATIVE_MAX_SIMILARITY = 0.95  # Pages plus proches que ça d'une page positive écartées (None pour désactiver)
+
+# Précision du scoring : "float32", "float16" ou "int8" (échelle par vecteur)
+RETRIEVAL_PRECISION = "float32"
+RESCORE_DEPTH = 100  # Candidats rescorés en pleine précision après un scoring en précision réduite
+
+# Évaluation incrémentale : appartenance à l'échantillon déterministe (hash de pdf/page)
+EVALUATION_SAMPLE_RATE = 1.0  # Part des entrées évaluées
+EVALUATION_SAMPLE_SEED = 0
+
 # Rate Limiter Settings
 REQUESTS_PER_SECOND = 10
 
+# Reranking : requêtes traitées simultanément et débit partagé des appels LLM
+RANKING_MAX_CONCURRENT_QUERIES = 10
+RANKING_REQUESTS_PER_SECOND = 5
+RANKING_RESUME = False  # Reprend le ranking en sautant les requêtes (texte + candidats) déjà présentes dans RANKED_RESULTS_JSONL
+RANKING_COMPACT = True  # Réécrit RANKED_RESULTS_FILE (JSON) à partir du JSONL en fin de ranking
+
+# Stratégie de reranking : "listwise" (toutes les pages en un appel), "windowed" (fenêtres glissantes)
+# ou "pointwise" (un appel par page, en parallèle)
+RERANK_STRATEGY = "listwise"
+RERANK_WINDOW_SIZE = 6  # Pages par appel LLM
+RERANK_WINDOW_STRIDE = 3  # Décalage entre fenêtres (< taille : fenêtres chevauchantes)
+RERANK_WINDOW_MERGE = "score"  # "score" (moyenne par fenêtre) ou "tournament" (tours éliminatoires)
+USE_RERANK_CACHE = True  # Réutilise les classements d'un même lot (requête, candidats, modèle, prompt)
+
+# Cascade : le classement par embeddings est gardé tel quel quand le top 1 est nettement devant
+RERANK_CASCADE = False
+CASCADE_MIN_MARGIN = 0.05  # Écart minimal de similarité entre le 1er et le 2e candidat
+CASCADE_MIN_SCORE = 0.3  # Similarité minimale du 1er candidat
+
+# Cache des images de pages préparées pour le ranking (partagé entre requêtes)
+PAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Tier mémoire (LRU)
+PAGE_CACHE_DIR = None  # Tier disque optionnel, ex: os.path.join(OUTPUT_DIR, "page_cache")
+
+# Préparation des images envoyées aux LLM (génération et ranking)
+IMAGE_FORMAT = "JPEG"  # JPEG, PNG ou WEBP
+IMAGE_QUALITY = 70
+IMAGE_MAX_EDGE = 1600  # Taille maximale du plus grand côté, en pixels (None pour désactiver)
+IMAGE_MAX_BYTES = 500_000  # Budget en octets par image (None pour désactiver)
+
+# Rendu des pages hors de la boucle asyncio (PyMuPDF n'est pas thread-safe : processus par défaut)
+RENDER_EXECUTOR = "process"  # "process" ou "thread"
+RENDER_WORKERS = min(8, os.cpu_count() or 1)
+RENDER_QUEUE_SIZE = 2 * RENDER_WORKERS  # Nombre maximal de rendus en attente ou en cours
+
+# Mémoire : budget global d'octets d'images en vol (rendues mais pas encore envoyées/répondues)
+IN_FLIGHT_IMAGE_BYTES = 256 * 1024 * 1024
+MAX_CONCURRENT_PDFS = 32  # Nombre de PDFs traités simultanément (chacun garde son image de contexte)
+
+# Sélection des pages de génération : les plus prometteuses d'abord (scheduling.page_priority_score)
+PRIORITIZE_PAGES = False  # False : tirage aléatoire
+PRIORITY_TEMPERATURE = 0.0  # 0 : ordre strict des scores ; plus élevé : plus de diversité
+
+# Génération distribuée : chaque worker traite le shard SHARD_INDEX parmi SHARD_COUNT
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_SEED = int(os.getenv("SHARD_SEED", "0"))  # Doit être identique sur tous les shards
+
 # Créer les dossiers nécessaires
 for directory in [OUTPUT_DIR, RESULTS_DIR]:
     os.makedirs(directory, exist_ok=True)
\ No newline at end of file
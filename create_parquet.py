@@ -5,8 +5,10 @@ from pathlib import Path
 import base64
 from pdf_utils import capture_page_image_hd
 from tqdm import tqdm  # Pour avoir une barre de progression
+from config import HARD_NEGATIVES_PER_QUERY
+from hard_negatives import mine_hard_negatives
 
-def create_training_parquets(jsonl_paths: list, pdf_folder: str, output_folder: str):
+def create_training_parquets(jsonl_paths: list, pdf_folder: str, output_folder: str, hard_negatives: int = HARD_NEGATIVES_PER_QUERY):
     # Initialize lists for training data with language sorting
     questions_by_lang = {
         'EN': [], 'FR': [], 'ES': [], 'IT': [], 'DE': []
@@ -167,6 +169,10 @@ def create_training_parquets(jsonl_paths: list, pdf_folder: str, output_folder:
         'image': images
     })
 
+    # Hard negatives : pages du corpus proches de la requête mais différentes de la page positive
+    if hard_negatives > 0:
+        train_df['neg'] = mine_hard_negatives(queries, pos_ids, docids, pdf_folder, hard_negatives)
+
     # Create output directory if it doesn't exist
     Path(output_folder).mkdir(parents=True, exist_ok=True)
 
@@ -176,6 +182,8 @@ def create_training_parquets(jsonl_paths: list, pdf_folder: str, output_folder:
 
     print(f"\nFinal Stats:")
     print(f"train.parquet: {len(train_df)} queries")
+    if 'neg' in train_df:
+        print(f"hard negatives: {sum(len(negs) for negs in train_df['neg'])}")
     print(f"corpus.parquet: {len(corpus_df)} images")
     print(f"Files saved in {output_folder}")
 
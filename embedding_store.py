@@ -0,0 +1,277 @@
+#embedding_store.py
+import os
+import re
+import json
+import hashlib
+import numpy as np
+from typing import Dict, List, Tuple, Optional, Callable, Awaitable
+from config import EMBEDDING_STORE_DIR, EMBEDDING_STORE_DTYPE, USE_EMBEDDING_STORE
+
+_file_hashes: Dict[Tuple[str, int, float], str] = {}  # (chemin, taille, mtime) -> sha256 du fichier
+STORE_WRITE_CHUNK = 1024  # Embeddings calculés puis écrits dans le store à la fois (cached_embedding_rows)
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    """Hash du contenu d'un fichier, mis en cache tant que sa taille et sa date ne changent pas."""
+    stat = os.stat(path)
+    cache_key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if cache_key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        _file_hashes[cache_key] = digest.hexdigest()
+    return _file_hashes[cache_key]
+
+
+def text_key(endpoint: str, text: str) -> str:
+    return f"text:{endpoint}:{_sha256(text.encode('utf-8'))}"
+
+
+def image_key(endpoint: str, image_bytes: bytes) -> str:
+    return f"image:{endpoint}:{_sha256(image_bytes)}"
+
+
+def page_key(endpoint: str, pdf_path: str, page_number: int, render: str = "1x") -> str:
+    """Clé d'une page de PDF : évite même le rendu quand l'embedding est déjà stocké."""
+    return f"page:{endpoint}:{file_hash(pdf_path)}:{page_number}:{render}"
+
+
+class EmbeddingStore:
+    """
+    Stockage local append-only des embeddings : matrice (float16 par défaut) lue en mémoire
+    mappée, et index JSONL clé -> ligne. Les vecteurs sont écrits avant leur entrée d'index,
+    si bien qu'un arrêt brutal ne laisse jamais de clé pointant vers une ligne incomplète.
+    """
+    def __init__(self, directory: str, dtype: str = EMBEDDING_STORE_DTYPE):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, "vectors.bin")
+        self.index_path = os.path.join(directory, "index.jsonl")
+        self.meta_path = os.path.join(directory, "meta.json")
+        os.makedirs(directory, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.dtype = np.dtype(meta["dtype"])
+            self.dim = meta["dim"]
+        self.index: Dict[str, int] = {}
+        self._rows = 0  # Lignes présentes dans vectors.bin (indexées ou non)
+        self._matrix = None
+        self._load_index()
+
+    def _load_index(self):
+        if self.dim is None or not os.path.exists(self.vectors_path):
+            return
+        row_bytes = self.dim * self.dtype.itemsize
+        file_size = os.path.getsize(self.vectors_path)
+        self._rows = file_size // row_bytes
+        if file_size != self._rows * row_bytes:
+            # Écriture interrompue : retire la ligne partielle pour garder les lignes alignées
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(self._rows * row_bytes)
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Ligne tronquée par un arrêt brutal
+                if entry["row"] < self._rows:
+                    self.index[entry["key"]] = entry["row"]
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def matrix(self) -> np.ndarray:
+        """Matrice de tous les vecteurs stockés, en mémoire mappée (lecture seule)."""
+        rows = self._rows
+        if rows == 0:
+            return np.zeros((0, self.dim or 0), dtype=self.dtype)
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=self.dtype, mode='r', shape=(rows, self.dim))
+        return self._matrix
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self.index.get(key)
+        if row is None:
+            return None
+        return np.asarray(self.matrix()[row], dtype=np.float32)
+
+    def get_many(self, keys: List[Optional[str]]) -> List[Optional[np.ndarray]]:
+        rows = [self.index.get(key) if key is not None else None for key in keys]
+        found = [i for i, row in enumerate(rows) if row is not None]
+        results = [None] * len(keys)
+        if found:
+            vectors = np.asarray(self.matrix()[[rows[i] for i in found]], dtype=np.float32)
+            for j, i in enumerate(found):
+                results[i] = vectors[j]
+        return results
+
+    def put(self, key: str, vector: np.ndarray):
+        self.put_many([key], [vector])
+
+    def put_many(self, keys: List[str], vectors: List[Optional[np.ndarray]]):
+        """Ajoute les vecteurs des clés absentes (les clés déjà présentes ou sans vecteur sont ignorées)."""
+        new_items = {}
+        for key, vector in zip(keys, vectors):
+            if key is not None and vector is not None and key not in self.index:
+                new_items[key] = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if not new_items:
+            return
+        if self.dim is None:
+            self.dim = len(next(iter(new_items.values())))
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({"dim": self.dim, "dtype": self.dtype.name}, f)
+        mismatched = [key for key, vector in new_items.items() if len(vector) != self.dim]
+        if mismatched:
+            print(f"Warning: {len(mismatched)} embeddings of dimension {len(new_items[mismatched[0]])} "
+                  f"not stored in {self.directory} (dimension {self.dim}); use one store per model")
+            new_items = {key: vector for key, vector in new_items.items() if len(vector) == self.dim}
+        if not new_items:
+            return
+        block = np.stack(list(new_items.values())).astype(self.dtype)
+        with open(self.vectors_path, 'ab') as f:
+            f.write(block.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            for offset, key in enumerate(new_items):
+                f.write(json.dumps({"key": key, "row": self._rows + offset}) + '\n')
+        for offset, key in enumerate(new_items):
+            self.index[key] = self._rows + offset
+        self._rows += len(new_items)
+
+
+class StoredEmbeddings:
+    """
+    Embeddings désignés par leur ligne dans le store (None si absent) et lus à la demande :
+    s'utilise comme une liste d'embeddings, sans garder de copie float32 de tout le corpus.
+    """
+    def __init__(self, store: EmbeddingStore, rows: List[Optional[int]]):
+        self.store = store
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, i: int) -> Optional[np.ndarray]:
+        row = self.rows[i]
+        return None if row is None else np.asarray(self.store.matrix()[row], dtype=np.float32)
+
+    def __iter__(self):
+        for i in range(len(self.rows)):
+            yield self[i]
+
+    def valid_indices(self) -> np.ndarray:
+        return np.array([i for i, row in enumerate(self.rows) if row is not None], dtype=np.int64)
+
+
+_default_stores: Dict[str, EmbeddingStore] = {}
+
+
+def get_default_store(model: str) -> Optional[EmbeddingStore]:
+    """
+    Store partagé du modèle `model` (endpoint ou identifiant du backend), dans un sous-dossier
+    de EMBEDDING_STORE_DIR : chaque modèle a sa propre dimension. None si USE_EMBEDDING_STORE est désactivé.
+    """
+    if not USE_EMBEDDING_STORE:
+        return None
+    if model not in _default_stores:
+        name = re.sub(r'[^A-Za-z0-9._-]+', '_', model).strip('_')[:64]
+        directory = os.path.join(EMBEDDING_STORE_DIR, f"{name}-{_sha256(model.encode('utf-8'))[:8]}")
+        _default_stores[model] = EmbeddingStore(directory)
+    return _default_stores[model]
+
+
+def cached_embeddings(
+    store: Optional[EmbeddingStore],
+    keys: List[Optional[str]],
+    compute: Callable[[List[int]], List[Optional[np.ndarray]]]
+) -> List[Optional[np.ndarray]]:
+    """
+    Cherche d'abord chaque clé dans le store, puis appelle `compute(positions_manquantes)`
+    pour les autres et enregistre les nouveaux embeddings. Sans store, tout est calculé.
+    """
+    if store is None:
+        return compute(list(range(len(keys))))
+    results = store.get_many(keys)
+    missing = [i for i, embedding in enumerate(results) if embedding is None]
+    if missing:
+        computed = compute(missing)
+        for i, embedding in zip(missing, computed):
+            results[i] = embedding
+        store.put_many([keys[i] for i in missing], computed)
+    print(f"Embedding store: {len(keys) - len(missing)}/{len(keys)} embeddings reused")
+    return results
+
+
+async def cached_embeddings_async(
+    store: Optional[EmbeddingStore],
+    keys: List[Optional[str]],
+    compute: Callable[[List[int]], Awaitable[List[Optional[np.ndarray]]]]
+) -> List[Optional[np.ndarray]]:
+    """Version asynchrone de `cached_embeddings`."""
+    if store is None:
+        return await compute(list(range(len(keys))))
+    results = store.get_many(keys)
+    missing = [i for i, embedding in enumerate(results) if embedding is None]
+    if missing:
+        computed = await compute(missing)
+        for i, embedding in zip(missing, computed):
+            results[i] = embedding
+        store.put_many([keys[i] for i in missing], computed)
+    print(f"Embedding store: {len(keys) - len(missing)}/{len(keys)} embeddings reused")
+    return results
+
+
+def _stored_rows(store: EmbeddingStore, keys: List[Optional[str]], missing: List[int]) -> List[Optional[int]]:
+    return [store.index.get(keys[i]) if keys[i] is not None else None for i in missing]
+
+
+def cached_embedding_rows(
+    store: EmbeddingStore,
+    keys: List[Optional[str]],
+    compute: Callable[[List[int]], List[Optional[np.ndarray]]],
+    chunk_size: int = STORE_WRITE_CHUNK
+) -> StoredEmbeddings:
+    """
+    Comme `cached_embeddings`, mais les embeddings manquants sont calculés et écrits dans le store
+    par tranches de `chunk_size` : seules les lignes du store sont retournées, jamais tout en float32.
+    """
+    rows = [store.index.get(key) if key is not None else None for key in keys]
+    missing = [i for i, row in enumerate(rows) if row is None]
+    for start in range(0, len(missing), chunk_size):
+        block = missing[start:start + chunk_size]
+        store.put_many([keys[i] for i in block], compute(block))
+        for i, row in zip(block, _stored_rows(store, keys, block)):
+            rows[i] = row
+    print(f"Embedding store: {len(keys) - len(missing)}/{len(keys)} embeddings reused")
+    return StoredEmbeddings(store, rows)
+
+
+async def cached_embedding_rows_async(
+    store: EmbeddingStore,
+    keys: List[Optional[str]],
+    compute: Callable[[List[int]], Awaitable[List[Optional[np.ndarray]]]],
+    chunk_size: int = STORE_WRITE_CHUNK
+) -> StoredEmbeddings:
+    """Version asynchrone de `cached_embedding_rows`."""
+    rows = [store.index.get(key) if key is not None else None for key in keys]
+    missing = [i for i, row in enumerate(rows) if row is None]
+    for start in range(0, len(missing), chunk_size):
+        block = missing[start:start + chunk_size]
+        store.put_many([keys[i] for i in block], await compute(block))
+        for i, row in zip(block, _stored_rows(store, keys, block)):
+            rows[i] = row
+    print(f"Embedding store: {len(keys) - len(missing)}/{len(keys)} embeddings reused")
+    return StoredEmbeddings(store, rows)
@@ -0,0 +1,374 @@
+#embeddings.py
+import io
+import os
+import sys
+import asyncio
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+import numpy as np
+import requests
+import aiohttp
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Tuple, Optional, Iterator
+from config import (
+    BASE_DIR, VECTAPI_HOST_IMAGE, VECTAPI_HOST_TEXT,
+    EMBED_BATCH_SIZE, EMBED_BATCH_MAX_BYTES, EMBED_POOL_SIZE, EMBED_TIMEOUT,
+    EMBED_MAX_CONCURRENCY, EMBED_REQUESTS_PER_SECOND,
+    EMBEDDING_BACKEND, LOCAL_EMBED_MODEL_PATH, LOCAL_EMBED_BATCH_SIZE, LOCAL_EMBED_THREADS,
+    LOCAL_EMBED_DIMENSION, LOCAL_EMBED_DEVICE
+)
+from utils import RateLimiter, process_with_retry
+
+
+class EmbeddingBatchResult:
+    """
+    Embeddings alignés sur les entrées : la ligne i de `embeddings` correspond à l'entrée i.
+    Les lignes des entrées en échec sont à zéro et repérées par `valid` / `errors`.
+    """
+    def __init__(self, embeddings: np.ndarray, valid: np.ndarray, errors: Dict[int, str]):
+        self.embeddings = embeddings
+        self.valid = valid
+        self.errors = errors
+
+    @property
+    def failed(self) -> List[int]:
+        return [i for i in range(len(self.valid)) if not self.valid[i]]
+
+    def get(self, i: int) -> Optional[np.ndarray]:
+        return self.embeddings[i] if self.valid[i] else None
+
+    def as_list(self) -> List[Optional[np.ndarray]]:
+        return [self.get(i) for i in range(len(self.valid))]
+
+
+def iter_batches(sizes: List[int], batch_size: int, max_batch_bytes: Optional[int]) -> Iterator[List[int]]:
+    """Découpe des indices en lots limités en nombre d'éléments et en octets (un élément trop gros forme son propre lot)."""
+    batch, batch_bytes = [], 0
+    for i, size in enumerate(sizes):
+        if batch and (len(batch) >= batch_size or (max_batch_bytes and batch_bytes + size > max_batch_bytes)):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(i)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+def _to_matrix(vectors: Dict[int, List[float]], n: int, errors: Dict[int, str]) -> EmbeddingBatchResult:
+    dim = len(next(iter(vectors.values()))) if vectors else 0
+    embeddings = np.zeros((n, dim), dtype=np.float32)
+    valid = np.zeros(n, dtype=bool)
+    for i, vector in vectors.items():
+        if len(vector) != dim:
+            errors[i] = f"Unexpected embedding size {len(vector)} (expected {dim})"
+            continue
+        embeddings[i] = vector
+        valid[i] = True
+    return EmbeddingBatchResult(embeddings, valid, errors)
+
+
+class EmbeddingBackend(ABC):
+    """
+    Interface commune des backends d'embedding de l'évaluation. `image_host` / `text_host`
+    identifient le modèle dans les clés du store d'embeddings : deux backends qui produisent
+    des vecteurs différents doivent avoir des identifiants différents.
+    """
+    image_host: str
+    text_host: str
+    batch_size: int
+
+    @abstractmethod
+    def embed_images(self, images: List[Tuple[bytes, str]]) -> EmbeddingBatchResult:
+        ...
+
+    @abstractmethod
+    def embed_texts(self, texts: List[str]) -> EmbeddingBatchResult:
+        ...
+
+
+class EmbeddingClient(EmbeddingBackend):
+    """Client HTTP des services d'embedding, par lots et avec une session (connexions réutilisées)."""
+    def __init__(
+        self,
+        image_host: str = VECTAPI_HOST_IMAGE,
+        text_host: str = VECTAPI_HOST_TEXT,
+        batch_size: int = EMBED_BATCH_SIZE,
+        max_batch_bytes: Optional[int] = EMBED_BATCH_MAX_BYTES,
+        pool_size: int = EMBED_POOL_SIZE,
+        timeout: float = EMBED_TIMEOUT
+    ):
+        self.image_host = image_host
+        self.text_host = text_host
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _post_images(self, images: List[Tuple[bytes, str]]) -> List[Optional[List[float]]]:
+        files = [('files', (filename, io.BytesIO(image_bytes), 'image/png')) for image_bytes, filename in images]
+        response = self.session.post(self.image_host, files=files, timeout=self.timeout)
+        response.raise_for_status()
+        results = response.json().get('results') or []
+        return [(results[i] or {}).get('embeddings') if i < len(results) else None for i in range(len(images))]
+
+    def _post_texts(self, texts: List[str]) -> List[Optional[List[float]]]:
+        response = self.session.post(self.text_host, json={"texts": texts}, timeout=self.timeout)
+        response.raise_for_status()
+        embeddings = response.json().get('embeddings') or []
+        return [embeddings[i] if i < len(embeddings) else None for i in range(len(texts))]
+
+    def _embed(self, items: List, sizes: List[int], post, label) -> EmbeddingBatchResult:
+        vectors, errors = {}, {}
+        batches = list(iter_batches(sizes, self.batch_size, self.max_batch_bytes))
+        while batches:
+            batch = batches.pop(0)
+            try:
+                batch_vectors = post([items[i] for i in batch])
+            except Exception as e:
+                print(f"Error embedding {label} batch of {len(batch)}: {str(e)}")
+                if len(batch) > 1:
+                    batches[:0] = [[i] for i in batch]  # Réessaie élément par élément pour isoler l'entrée fautive
+                    continue
+                errors[batch[0]] = str(e)
+                continue
+            for i, vector in zip(batch, batch_vectors):
+                if vector:
+                    vectors[i] = vector
+                else:
+                    errors[i] = "No embeddings found in response"
+        if errors:
+            print(f"{len(errors)}/{len(items)} {label} embeddings failed")
+        return _to_matrix(vectors, len(items), errors)
+
+    def embed_images(self, images: List[Tuple[bytes, str]]) -> EmbeddingBatchResult:
+        """Embeddings d'images (octets, nom de fichier), par lots."""
+        return self._embed(images, [len(image_bytes) for image_bytes, _ in images], self._post_images, "image")
+
+    def embed_texts(self, texts: List[str]) -> EmbeddingBatchResult:
+        """Embeddings de textes, par lots."""
+        return self._embed(texts, [len(text.encode('utf-8')) for text in texts], self._post_texts, "text")
+
+
+class AsyncEmbeddingClient:
+    """
+    Client asynchrone des services d'embedding : lots envoyés en parallèle avec une limite
+    de concurrence, un rate limit et des retries. À utiliser avec `async with`.
+    """
+    def __init__(
+        self,
+        image_host: str = VECTAPI_HOST_IMAGE,
+        text_host: str = VECTAPI_HOST_TEXT,
+        batch_size: int = EMBED_BATCH_SIZE,
+        max_batch_bytes: Optional[int] = EMBED_BATCH_MAX_BYTES,
+        max_concurrency: int = EMBED_MAX_CONCURRENCY,
+        requests_per_second: int = EMBED_REQUESTS_PER_SECOND,
+        timeout: float = EMBED_TIMEOUT,
+        max_retries: int = 3
+    ):
+        self.image_host = image_host
+        self.text_host = text_host
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate_limiter = RateLimiter(requests_per_second=requests_per_second)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.session = None
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _post_images(self, images: List[Tuple[bytes, str]]) -> List[Optional[List[float]]]:
+        form = aiohttp.FormData()
+        for image_bytes, filename in images:
+            form.add_field('files', image_bytes, filename=filename, content_type='image/png')
+        async with self.session.post(self.image_host, data=form) as response:
+            response.raise_for_status()
+            results = (await response.json()).get('results') or []
+        return [(results[i] or {}).get('embeddings') if i < len(results) else None for i in range(len(images))]
+
+    async def _post_texts(self, texts: List[str]) -> List[Optional[List[float]]]:
+        async with self.session.post(self.text_host, json={"texts": texts}) as response:
+            response.raise_for_status()
+            embeddings = (await response.json()).get('embeddings') or []
+        return [embeddings[i] if i < len(embeddings) else None for i in range(len(texts))]
+
+    async def _post_batch(self, post, batch_items: List) -> List[Optional[List[float]]]:
+        async with self._semaphore:
+            async with self.rate_limiter:
+                result = await post(batch_items)
+            await self.rate_limiter.record_success()
+            return result
+
+    async def _embed_batch(self, items: List, batch: List[int], post, label, vectors: Dict, errors: Dict):
+        try:
+            batch_vectors = await process_with_retry(
+                self._post_batch, post, [items[i] for i in batch], max_retries=self.max_retries
+            )
+        except Exception as e:
+            print(f"Error embedding {label} batch of {len(batch)}: {str(e)}")
+            if len(batch) > 1:  # Réessaie élément par élément pour isoler l'entrée fautive
+                await asyncio.gather(*[self._embed_batch(items, [i], post, label, vectors, errors) for i in batch])
+            else:
+                errors[batch[0]] = str(e)
+            return
+        for i, vector in zip(batch, batch_vectors):
+            if vector:
+                vectors[i] = vector
+            else:
+                errors[i] = "No embeddings found in response"
+
+    async def _embed(self, items: List, sizes: List[int], post, label) -> EmbeddingBatchResult:
+        if self.session is None:
+            raise RuntimeError("AsyncEmbeddingClient must be used with 'async with'")
+        vectors, errors = {}, {}
+        await asyncio.gather(*[
+            self._embed_batch(items, batch, post, label, vectors, errors)
+            for batch in iter_batches(sizes, self.batch_size, self.max_batch_bytes)
+        ])
+        if errors:
+            print(f"{len(errors)}/{len(items)} {label} embeddings failed")
+        return _to_matrix(vectors, len(items), errors)
+
+    async def embed_images(self, images: List[Tuple[bytes, str]]) -> EmbeddingBatchResult:
+        return await self._embed(images, [len(image_bytes) for image_bytes, _ in images], self._post_images, "image")
+
+    async def embed_texts(self, texts: List[str]) -> EmbeddingBatchResult:
+        return await self._embed(texts, [len(text.encode('utf-8')) for text in texts], self._post_texts, "text")
+
+
+class LocalMCDSEBackend(EmbeddingBackend):
+    """
+    Backend en process : le modèle mcdse-2b-v1 de `vect/mcdse.py`, sans réseau.
+    torch et transformers ne sont importés qu'à la création du backend.
+    """
+    def __init__(
+        self,
+        model_path: str = LOCAL_EMBED_MODEL_PATH,
+        batch_size: int = LOCAL_EMBED_BATCH_SIZE,
+        num_threads: int = LOCAL_EMBED_THREADS,
+        dimension: int = LOCAL_EMBED_DIMENSION,
+        device: Optional[str] = LOCAL_EMBED_DEVICE
+    ):
+        import torch
+        sys.path.append(os.path.join(BASE_DIR, "vect"))
+        from mcdse import MCDSEModel
+        torch.set_num_threads(num_threads)
+        self.model = MCDSEModel(
+            model_path=model_path, device=device, batch_size=batch_size, dimension=dimension, use_fake=False
+        )
+        self.batch_size = batch_size
+        self.image_host = f"local:{model_path}:{self.model.dimension}"
+        self.text_host = self.image_host
+        self._lock = threading.Lock()  # Un seul appel au modèle à la fois
+
+    def _encode(self, items: List, encode, label) -> EmbeddingBatchResult:
+        vectors, errors = {}, {}
+        for start in range(0, len(items), self.batch_size):
+            batch = list(range(start, min(start + self.batch_size, len(items))))
+            try:
+                with self._lock:
+                    embeddings = encode([items[i] for i in batch]).float().cpu().numpy()
+                vectors.update({i: embeddings[j] for j, i in enumerate(batch)})
+            except Exception as e:
+                print(f"Error embedding {label} batch of {len(batch)}: {str(e)}")
+                errors.update({i: str(e) for i in batch})
+        return _to_matrix(vectors, len(items), errors)
+
+    def embed_images(self, images: List[Tuple[bytes, str]]) -> EmbeddingBatchResult:
+        from PIL import Image
+        decoded = [Image.open(io.BytesIO(image_bytes)).convert('RGB') for image_bytes, _ in images]
+        return self._encode(decoded, self.model.encode_documents, "image")
+
+    def embed_texts(self, texts: List[str]) -> EmbeddingBatchResult:
+        return self._encode(texts, self.model.encode_queries, "text")
+
+
+class FakeEmbeddingBackend(EmbeddingBackend):
+    """Embeddings déterministes dérivés du hash du contenu, pour les tests et les essais hors ligne."""
+    def __init__(self, dimension: int = LOCAL_EMBED_DIMENSION, batch_size: int = EMBED_BATCH_SIZE):
+        self.dimension = dimension
+        self.batch_size = batch_size
+        self.image_host = f"fake:{dimension}"
+        self.text_host = self.image_host
+
+    def _vector(self, data: bytes) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(data).digest()[:8], 'big')
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def embed_images(self, images: List[Tuple[bytes, str]]) -> EmbeddingBatchResult:
+        return _to_matrix({i: self._vector(image_bytes) for i, (image_bytes, _) in enumerate(images)}, len(images), {})
+
+    def embed_texts(self, texts: List[str]) -> EmbeddingBatchResult:
+        return _to_matrix({i: self._vector(text.encode('utf-8')) for i, text in enumerate(texts)}, len(texts), {})
+
+
+class AsyncBackendAdapter:
+    """Expose un backend synchrone (local, fake) avec l'interface de `AsyncEmbeddingClient`."""
+    def __init__(self, backend: EmbeddingBackend, max_concurrency: int = 1):
+        self.backend = backend
+        self.image_host = backend.image_host
+        self.text_host = backend.text_host
+        self.batch_size = backend.batch_size
+        self.max_concurrency = max_concurrency
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self):
+        pass
+
+    async def embed_images(self, images: List[Tuple[bytes, str]]) -> EmbeddingBatchResult:
+        return await asyncio.to_thread(self.backend.embed_images, images)
+
+    async def embed_texts(self, texts: List[str]) -> EmbeddingBatchResult:
+        return await asyncio.to_thread(self.backend.embed_texts, texts)
+
+
+def create_backend(name: str = EMBEDDING_BACKEND) -> EmbeddingBackend:
+    if name == "http":
+        return EmbeddingClient()
+    if name == "local":
+        return LocalMCDSEBackend()
+    if name == "fake":
+        return FakeEmbeddingBackend()
+    raise ValueError(f"Unknown embedding backend: {name}")
+
+
+_default_client = None
+
+
+def get_default_client() -> EmbeddingBackend:
+    """Backend synchrone partagé, choisi par EMBEDDING_BACKEND."""
+    global _default_client
+    if _default_client is None:
+        _default_client = create_backend()
+    return _default_client
+
+
+async def open_async_client():
+    """Client asynchrone du backend configuré (à fermer avec `close()`)."""
+    if EMBEDDING_BACKEND == "http":
+        return await AsyncEmbeddingClient().__aenter__()
+    return AsyncBackendAdapter(get_default_client())
@@ -1,15 +1,24 @@
 #evaluation.py
 import json
 import random
-import requests
-import io
+import asyncio
 import numpy as np
 from pathlib import Path
-from typing import List, Dict, Optional
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import normalize
-from config import VECTAPI_HOST_IMAGE, VECTAPI_HOST_TEXT
+from typing import List, Dict, Optional, Tuple
 from pdf_utils import capture_page_image
+from embeddings import EmbeddingBackend, AsyncEmbeddingClient, get_default_client, open_async_client
+from utils import run_blocking
+from retrieval import stack_embeddings, score_queries, ndcg_at_k, StreamingTopK
+from sampling import count_pdf_pages, iter_pages
+from ann_index import IVFFlatIndex
+from quantization import QuantizedMatrix, EmbeddingRows, quantized_score_queries, precision_report
+from config import RETRIEVAL_SEARCH, ANN_RANK_DEPTH, RETRIEVAL_PRECISION, RESCORE_DEPTH
+from embedding_store import (
+    EmbeddingStore, StoredEmbeddings, get_default_store, page_key, text_key,
+    cached_embeddings, cached_embeddings_async, cached_embedding_rows, cached_embedding_rows_async
+)
+
+FULL_CORPUS_BLOCK_SIZE = 4096  # Pages embeddées et scorées par bloc lors de l'évaluation sur tout le corpus
 
 def get_recall_position(similarities: np.ndarray, correct_idx: int) -> int:
     sorted_indices = np.argsort(similarities)[::-1]
@@ -32,38 +41,16 @@ def load_random_jsonl_entries(jsonl_path: str, n_samples: int = 500) -> List[Dic
     return random.sample(all_entries, min(n_samples, len(all_entries)))
 
 def embed_image(image_bytes: bytes, filename: str) -> Optional[np.ndarray]:
-    try:
-        file_obj = io.BytesIO(image_bytes)
-        file_obj.seek(0)
-        files = [('files', (filename, file_obj, 'image/png'))]
-        response = requests.post(VECTAPI_HOST_IMAGE, files=files)
-        response.raise_for_status()
-        result = response.json()
-        if not result.get('results'):
-            print(f"Empty results in image embedding response for {filename}")
-            return None
-        embeddings = result['results'][0].get('embeddings')
-        if not embeddings:
-            print(f"No embeddings found in response for {filename}")
-            return None
-        return np.array(embeddings)
-    except Exception as e:
-        print(f"Error embedding image {filename}: {str(e)}")
-        return None
+    result = get_default_client().embed_images([(image_bytes, filename)])
+    if result.get(0) is None:
+        print(f"Error embedding image {filename}: {result.errors.get(0)}")
+    return result.get(0)
 
 def embed_text(text: str) -> Optional[np.ndarray]:
-    try:
-        payload = {"texts": [text]}
-        response = requests.post(VECTAPI_HOST_TEXT, json=payload)
-        response.raise_for_status()
-        result = response.json()
-        if not result.get('embeddings'):
-            print("No embeddings found in text response")
-            return None
-        return np.array(result['embeddings'][0])
-    except Exception as e:
-        print(f"Error embedding text: {str(e)}")
-        return None
+    result = get_default_client().embed_texts([text])
+    if result.get(0) is None:
+        print(f"Error embedding text: {result.errors.get(0)}")
+    return result.get(0)
 
 def calculate_ndcg(relevance_scores: np.ndarray, similarities: np.ndarray, correct_idx: int, k: int = 5) -> float:
     if len(similarities) == 0:
@@ -82,108 +69,542 @@ def calculate_recall_at_1(similarities: np.ndarray, correct_idx: int) -> float:
     predicted_idx = np.argmax(similarities)
     return 1.0 if predicted_idx == correct_idx else 0.0
 
-def process_all_images(entries: List[Dict], pdf_folder: str) -> List[Optional[np.ndarray]]:
-    image_embeddings = []
+def entry_page_keys(entries: List[Dict], pdf_folder: str, endpoint: str) -> List[Optional[str]]:
+    """Clés du store pour les pages des entrées (None si le PDF est introuvable)."""
+    keys = []
     for entry in entries:
         pdf_path = Path(pdf_folder) / entry['pdf_name']
-        if not pdf_path.exists():
-            print(f"PDF file not found: {pdf_path}")
-            image_embeddings.append(None)
-            continue
-        image_bytes = capture_page_image(str(pdf_path), entry['page_number'])
-        if image_bytes is None:
-            print(f"Failed to capture page image for {pdf_path}")
-            image_embeddings.append(None)
-            continue
-        image_embedding = embed_image(image_bytes, f"{entry['pdf_name']}_p{entry['page_number']}.png")
-        image_embeddings.append(image_embedding)
+        keys.append(page_key(endpoint, str(pdf_path), entry['page_number']) if pdf_path.exists() else None)
+    return keys
+
+def query_keys(queries: List[Optional[str]], endpoint: str) -> List[Optional[str]]:
+    return [text_key(endpoint, query) if query else None for query in queries]
+
+def _embed_entry_pages(entries: List[Dict], pdf_folder: str, client: EmbeddingBackend) -> List[Optional[np.ndarray]]:
+    image_embeddings = []
+    # Rendu et embedding par tranches pour ne pas garder toutes les images en mémoire
+    chunk_size = client.batch_size * 4
+    for start in range(0, len(entries), chunk_size):
+        chunk_embeddings = [None] * len(entries[start:start + chunk_size])
+        images, positions = [], []
+        for offset, entry in enumerate(entries[start:start + chunk_size]):
+            pdf_path = Path(pdf_folder) / entry['pdf_name']
+            if not pdf_path.exists():
+                print(f"PDF file not found: {pdf_path}")
+                continue
+            image_bytes = capture_page_image(str(pdf_path), entry['page_number'])
+            if image_bytes is None:
+                print(f"Failed to capture page image for {pdf_path}")
+                continue
+            images.append((image_bytes, f"{entry['pdf_name']}_p{entry['page_number']}.png"))
+            positions.append(offset)
+        if images:
+            result = client.embed_images(images)
+            for i, offset in enumerate(positions):
+                chunk_embeddings[offset] = result.get(i)
+        image_embeddings.extend(chunk_embeddings)
     return image_embeddings
 
+def process_all_images(
+    entries: List[Dict],
+    pdf_folder: str,
+    client: EmbeddingBackend = None,
+    store: Optional[EmbeddingStore] = None,
+    in_store: bool = False
+) -> List[Optional[np.ndarray]]:
+    """
+    Embeddings des pages des entrées ; seules les pages absentes du store sont rendues et envoyées.
+    Avec `in_store` (et un store), retourne une vue `StoredEmbeddings` sur les lignes du store
+    plutôt qu'une liste float32 : le corpus n'est jamais entièrement chargé en mémoire.
+    """
+    client = client or get_default_client()
+    store = store if store is not None else get_default_store(client.image_host)
+    keys = entry_page_keys(entries, pdf_folder, client.image_host)
+    compute = lambda missing: _embed_entry_pages([entries[i] for i in missing], pdf_folder, client)
+    if in_store and store is not None:
+        return cached_embedding_rows(store, keys, compute)
+    return cached_embeddings(store, keys, compute)
+
+async def capture_entry_page_async(entry: Dict, pdf_folder: str) -> Optional[bytes]:
+    pdf_path = Path(pdf_folder) / entry['pdf_name']
+    if not pdf_path.exists():
+        print(f"PDF file not found: {pdf_path}")
+        return None
+    image_bytes = await run_blocking(capture_page_image, str(pdf_path), entry['page_number'])
+    if image_bytes is None:
+        print(f"Failed to capture page image for {pdf_path}")
+    return image_bytes
+
+async def _embed_entry_pages_async(entries: List[Dict], pdf_folder: str, client: AsyncEmbeddingClient) -> List[Optional[np.ndarray]]:
+    image_embeddings = [None] * len(entries)
+    chunk_semaphore = asyncio.Semaphore(client.max_concurrency * 2)  # Limite les lots rendus en attente d'envoi
+
+    async def process_chunk(start: int):
+        async with chunk_semaphore:
+            chunk = entries[start:start + client.batch_size]
+            rendered = await asyncio.gather(*[capture_entry_page_async(entry, pdf_folder) for entry in chunk])
+            images, positions = [], []
+            for offset, (entry, image_bytes) in enumerate(zip(chunk, rendered)):
+                if image_bytes is not None:
+                    images.append((image_bytes, f"{entry['pdf_name']}_p{entry['page_number']}.png"))
+                    positions.append(start + offset)
+            if images:
+                result = await client.embed_images(images)
+                for i, position in enumerate(positions):
+                    image_embeddings[position] = result.get(i)
+
+    await asyncio.gather(*[process_chunk(start) for start in range(0, len(entries), client.batch_size)])
+    return image_embeddings
+
+async def process_all_images_async(
+    entries: List[Dict],
+    pdf_folder: str,
+    client: AsyncEmbeddingClient,
+    store: Optional[EmbeddingStore] = None,
+    in_store: bool = False
+) -> List[Optional[np.ndarray]]:
+    """Même résultat que `process_all_images`, avec le rendu dans l'executor et les lots d'embedding en parallèle."""
+    store = store if store is not None else get_default_store(client.image_host)
+    keys = entry_page_keys(entries, pdf_folder, client.image_host)
+    compute = lambda missing: _embed_entry_pages_async([entries[i] for i in missing], pdf_folder, client)
+    if in_store and store is not None:
+        return await cached_embedding_rows_async(store, keys, compute)
+    return await cached_embeddings_async(store, keys, compute)
+
+async def _embed_texts_async(queries: List[Optional[str]], client: AsyncEmbeddingClient) -> List[Optional[np.ndarray]]:
+    positions = [i for i, query in enumerate(queries) if query]
+    embeddings = [None] * len(queries)
+    if positions:
+        result = await client.embed_texts([queries[i] for i in positions])
+        for j, i in enumerate(positions):
+            embeddings[i] = result.get(j)
+    return embeddings
+
+async def embed_queries_async(
+    queries: List[Optional[str]],
+    client: AsyncEmbeddingClient,
+    store: Optional[EmbeddingStore] = None
+) -> List[Optional[np.ndarray]]:
+    store = store if store is not None else get_default_store(client.image_host)
+    return await cached_embeddings_async(
+        store, query_keys(queries, client.text_host),
+        lambda missing: _embed_texts_async([queries[i] for i in missing], client)
+    )
+
+def _embed_texts(queries: List[Optional[str]], client: EmbeddingBackend) -> List[Optional[np.ndarray]]:
+    positions = [i for i, query in enumerate(queries) if query]
+    embeddings = [None] * len(queries)
+    if positions:
+        result = client.embed_texts([queries[i] for i in positions])
+        for j, i in enumerate(positions):
+            embeddings[i] = result.get(j)
+    return embeddings
+
+def embed_queries(
+    queries: List[Optional[str]],
+    client: EmbeddingBackend = None,
+    store: Optional[EmbeddingStore] = None
+) -> List[Optional[np.ndarray]]:
+    """Embeddings des requêtes par lots, alignés sur `queries` (None pour les requêtes absentes ou en échec)."""
+    client = client or get_default_client()
+    store = store if store is not None else get_default_store(client.image_host)
+    return cached_embeddings(
+        store, query_keys(queries, client.text_host),
+        lambda missing: _embed_texts([queries[i] for i in missing], client)
+    )
+
+def _query_result(query: str, entry: Dict, rank: int, gold_score: float,
+                  top_pages: List[Dict], top_scores: np.ndarray) -> Dict:
+    top_matches = []
+    for match, score in zip(top_pages, top_scores):
+        top_matches.append({
+            'pdf_name': match['pdf_name'],
+            'page_number': match['page_number'],
+            'similarity_score': float(score)
+        })
+    return {
+        'query': query,
+        'pdf_name': entry['pdf_name'],
+        'page_number': entry['page_number'],
+        'recall_position': int(rank),
+        'similarity_score': float(gold_score),
+        'ndcg_score': float(ndcg_at_k(np.array([rank]), 5)[0]),
+        'recall_at_1': float(rank == 0),
+        'top_15_matches': top_matches
+    }
+
+def ann_score_queries(
+    query_matrix: np.ndarray,
+    image_matrix: np.ndarray,
+    gold_columns: np.ndarray,
+    top_k: int = 15,
+    depth: int = ANN_RANK_DEPTH
+):
+    """
+    Équivalent ANN de `score_queries` : la page attendue est cherchée parmi les `depth` premiers
+    résultats de l'index ; absente, son rang vaut `depth` (borne inférieure du vrai rang).
+    """
+    index = IVFFlatIndex().build(image_matrix)
+    ids, scores = index.search(query_matrix, max(top_k, depth))
+    found = ids == gold_columns[:, None]
+    ranks = np.where(found.any(axis=1), found.argmax(axis=1), ids.shape[1])
+    gold_scores = np.sum(query_matrix * image_matrix[gold_columns], axis=1)
+    top_indices, top_scores = ids[:, :top_k], scores[:, :top_k]
+    return top_indices, top_scores, ranks, gold_scores
+
+def score_entries(
+    entries: List[Dict],
+    queries: List[Optional[str]],
+    image_embeddings: List[Optional[np.ndarray]],
+    text_embeddings: List[Optional[np.ndarray]],
+    top_k: int = 15,
+    search: str = RETRIEVAL_SEARCH,
+    precision: str = RETRIEVAL_PRECISION,
+    gold_indices: Optional[List[int]] = None
+) -> List[Optional[Dict]]:
+    """
+    Score toutes les requêtes d'un coup : matrice des pages normalisée une seule fois,
+    puis produit matriciel requêtes x pages (`search="exact"`) ou recherche dans un index IVF
+    (`search="ann"`). En recherche exacte, `precision` ("float16", "int8") score la matrice en
+    précision réduite avant de rescorer les meilleurs candidats. None pour les requêtes non évaluables.
+    La requête i cible la page de l'entrée `gold_indices[i]` (par défaut, l'entrée i).
+    """
+    gold_indices = gold_indices if gold_indices is not None else list(range(len(queries)))
+    if isinstance(image_embeddings, StoredEmbeddings):
+        valid_indices = image_embeddings.valid_indices()
+    else:
+        valid_indices = np.array([i for i, embedding in enumerate(image_embeddings) if embedding is not None], dtype=np.int64)
+    column_of = {int(original): column for column, original in enumerate(valid_indices)}
+    scored = [
+        i for i, query in enumerate(queries)
+        if query and text_embeddings[i] is not None and gold_indices[i] in column_of
+    ]
+    results = [None] * len(queries)
+    if not scored:
+        return results
+    query_matrix, _ = stack_embeddings([text_embeddings[i] for i in scored])
+    gold_columns = np.array([column_of[gold_indices[i]] for i in scored], dtype=np.int64)
+    if search == "exact" and precision != "float32":
+        # Pas de matrice float32 empilée : quantification par blocs, rescoring depuis les seuls candidats
+        if isinstance(image_embeddings, StoredEmbeddings):
+            matrix = image_embeddings.store.matrix()  # memmap float16 du store
+            rows = np.array([image_embeddings.rows[i] for i in valid_indices], dtype=np.int64)
+            quantized = QuantizedMatrix.from_matrix_rows(matrix, rows, precision)
+            full_rows = EmbeddingRows(matrix, rows)
+        else:
+            valid_embeddings = [image_embeddings[i] for i in valid_indices]
+            quantized = QuantizedMatrix.from_rows(valid_embeddings, precision)
+            full_rows = EmbeddingRows(valid_embeddings)
+        top_indices, top_scores, ranks, gold_scores = quantized_score_queries(
+            query_matrix, quantized, full_rows, gold_columns, top_k, RESCORE_DEPTH
+        )
+    elif search == "ann":
+        image_matrix, _ = stack_embeddings(image_embeddings)
+        top_indices, top_scores, ranks, gold_scores = ann_score_queries(query_matrix, image_matrix, gold_columns, top_k)
+    elif search == "exact":
+        image_matrix, _ = stack_embeddings(image_embeddings)
+        top_indices, top_scores, ranks, gold_scores = score_queries(query_matrix, image_matrix, gold_columns, top_k)
+    else:
+        raise ValueError(f"Unknown search mode: {search}")
+    for j, i in enumerate(scored):
+        kept = top_indices[j] >= 0  # L'index ANN peut renvoyer moins de top_k pages
+        top_pages = [entries[valid_indices[idx]] for idx in top_indices[j][kept]]
+        gold_entry = entries[gold_indices[i]]
+        results[i] = _query_result(queries[i], gold_entry, ranks[j], gold_scores[j], top_pages, top_scores[j][kept])
+    return results
+
 def process_single_query(
     query: str,
     image_embeddings: List[np.ndarray],
     query_idx: int,
-    entries: List[Dict]
+    entries: List[Dict],
+    text_embedding: Optional[np.ndarray] = None
 ) -> Optional[Dict]:
     try:
-        text_embedding = embed_text(query)
+        if text_embedding is None:
+            text_embedding = embed_text(query)
         if text_embedding is None:
             return None
-        text_embedding = normalize(text_embedding.reshape(1, -1))
-        similarities = []
-        valid_indices = []
-        for i, img_emb in enumerate(image_embeddings):
-            if img_emb is not None:
-                img_emb = normalize(img_emb.reshape(1, -1))
-                similarity = cosine_similarity(text_embedding, img_emb)[0][0]
-                similarities.append(similarity)
-                valid_indices.append(i)
-        if not similarities:
-            return None
-        similarities = np.array(similarities)
-        recall_position = get_recall_position(similarities, valid_indices.index(query_idx))
-        ndcg = calculate_ndcg(
-            relevance_scores=None,
-            similarities=similarities,
-            correct_idx=valid_indices.index(query_idx),
-            k=5
-        )
-        top_k = 15
-        top_indices = np.argsort(similarities)[::-1][:top_k]
-        top_matches = []
-        for idx in top_indices:
-            original_idx = valid_indices[idx]
-            entry = entries[original_idx]
-            top_matches.append({
-                'pdf_name': entry['pdf_name'],
-                'page_number': entry['page_number'],
-                'similarity_score': float(similarities[idx])
-            })
-        return {
-            'query': query,
-            'pdf_name': entries[query_idx]['pdf_name'],
-            'page_number': entries[query_idx]['page_number'],
-            'recall_position': int(recall_position),
-            'similarity_score': float(similarities[valid_indices.index(query_idx)]),
-            'ndcg_score': float(ndcg),
-            'top_15_matches': top_matches
-        }
+        queries = [None] * len(entries)
+        text_embeddings = [None] * len(entries)
+        queries[query_idx], text_embeddings[query_idx] = query, text_embedding
+        return score_entries(entries, queries, image_embeddings, text_embeddings)[query_idx]
     except Exception as e:
         print(f"Error processing query: {str(e)}")
         return None
 
-def process_and_evaluate_entries(entries: List[Dict], pdf_folder: str) -> Dict:
-    all_results = []
-    successful_entries = 0
-    failed_entries = 0
-    image_embeddings = process_all_images(entries, pdf_folder)
-    for i, entry in enumerate(entries):
-        query = entry.get('queries', {}).get('multimodal_query')
-        if not query:
-            failed_entries += 1
-            continue
-        result = process_single_query(query, image_embeddings, i, entries)
-        if result:
-            all_results.append(result)
-            successful_entries += 1
-        else:
-            failed_entries += 1
-    recall_positions = [r['recall_position'] for r in all_results]
-    ndcg_scores = [r['ndcg_score'] for r in all_results]
-    similarity_scores = [r['similarity_score'] for r in all_results]
+def process_and_evaluate_entries(
+    entries: List[Dict],
+    pdf_folder: str,
+    store: Optional[EmbeddingStore] = None,
+    search: str = RETRIEVAL_SEARCH,
+    precision: str = RETRIEVAL_PRECISION
+) -> Dict:
+    # En précision réduite, les pages restent dans le store (memmap) au lieu d'une liste float32
+    image_embeddings = process_all_images(entries, pdf_folder, store=store, in_store=precision != "float32")
+    queries = [entry.get('queries', {}).get('multimodal_query') for entry in entries]
+    text_embeddings = embed_queries(queries, store=store)
+    return evaluate_embeddings(entries, queries, image_embeddings, text_embeddings, search, precision)
+
+async def process_and_evaluate_entries_async(
+    entries: List[Dict],
+    pdf_folder: str,
+    client: AsyncEmbeddingClient = None,
+    store: Optional[EmbeddingStore] = None,
+    search: str = RETRIEVAL_SEARCH,
+    precision: str = RETRIEVAL_PRECISION
+) -> Dict:
+    """Version asynchrone de `process_and_evaluate_entries` : pages et requêtes sont embeddées en parallèle."""
+    queries = [entry.get('queries', {}).get('multimodal_query') for entry in entries]
+    owns_client = client is None
+    if owns_client:
+        client = await open_async_client()
+    try:
+        image_embeddings, text_embeddings = await asyncio.gather(
+            process_all_images_async(entries, pdf_folder, client, store, in_store=precision != "float32"),
+            embed_queries_async(queries, client, store)
+        )
+    finally:
+        if owns_client:
+            await client.close()
+    return evaluate_embeddings(entries, queries, image_embeddings, text_embeddings, search, precision)
+
+def retrieval_metrics(results: List[Dict]) -> Dict:
+    return {
+        'average_recall_position': float(np.mean([r['recall_position'] for r in results])),
+        'average_ndcg': float(np.mean([r['ndcg_score'] for r in results])),
+        'average_recall_at_1': float(np.mean([r['recall_at_1'] for r in results])),
+        'average_similarity': float(np.mean([r['similarity_score'] for r in results]))
+    }
+
+def summarize_results(all_results: List[Dict], total_entries: int, output_path: str = 'retrieval_results_fixed.json') -> Dict:
+    successful_entries = len(all_results)
+    failed_entries = total_entries - successful_entries
     output = {
         'query_results': all_results,
         'summary': {
-            'average_recall_position': float(np.mean(recall_positions)),
-            'average_ndcg': float(np.mean(ndcg_scores)),
-            'average_similarity': float(np.mean(similarity_scores)),
+            **retrieval_metrics(all_results),
             'successful_entries': successful_entries,
             'failed_entries': failed_entries
         }
     }
     
     # Save results to the correct file
-    with open('retrieval_results_fixed.json', 'w', encoding='utf-8') as f:
+    with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(output, f, ensure_ascii=False, indent=2)
     
-    return output
\ No newline at end of file
+    return output
+
+# Champs de requêtes produits par les générateurs : main2.py, main.py (langue au niveau de l'entrée)
+# et query-benchmark.py (une requête par langue)
+QUERY_FIELDS = [
+    'multimodal_query', 'main_query', 'secondary_query', 'visual_query',
+    'query1', 'query2', 'query3',
+    'reference', 'en', 'es', 'de', 'it'
+]
+LANGUAGE_FIELDS = {'en': 'EN', 'es': 'ES', 'de': 'DE', 'it': 'IT', 'reference': 'reference'}
+
+def _is_valid_query(text) -> bool:
+    return isinstance(text, str) and text.strip() not in ('', 'NaN', '"NaN"')
+
+def query_language(entry: Dict, field: str) -> Optional[str]:
+    """Langue d'une requête : celle du champ (query-benchmark) ou celle de l'entrée (main.py)."""
+    if field in LANGUAGE_FIELDS:
+        return LANGUAGE_FIELDS[field]
+    queries = entry.get('queries') or {}
+    return entry.get('language') or queries.get('language')
+
+def collect_field_queries(entries: List[Dict], fields: Optional[List[str]] = None) -> List[Dict]:
+    """Liste à plat des requêtes (entrée, champ, langue, texte) des champs demandés (par défaut : tous ceux présents)."""
+    collected = []
+    for i, entry in enumerate(entries):
+        queries = entry.get('queries') or {}
+        if queries.get('relevant') is False:
+            continue  # Page jugée non pertinente par query-benchmark.py
+        for field in fields or QUERY_FIELDS:
+            if _is_valid_query(queries.get(field)):
+                collected.append({
+                    'entry_index': i, 'field': field,
+                    'language': query_language(entry, field), 'query': queries[field]
+                })
+    return collected
+
+def _metrics_table(results: List[Dict], key: str) -> Dict[str, Dict]:
+    groups = {}
+    for result in results:
+        groups.setdefault(str(result[key]), []).append(result)
+    return {group: {**retrieval_metrics(items), 'count': len(items)} for group, items in sorted(groups.items())}
+
+def _print_metrics_table(title: str, table: Dict[str, Dict]):
+    print(f"\n{title:<20} {'count':>6} {'recall_pos':>10} {'ndcg@5':>8} {'recall@1':>8}")
+    for group, metrics in table.items():
+        print(f"{group:<20} {metrics['count']:>6} {metrics['average_recall_position']:>10.2f} "
+              f"{metrics['average_ndcg']:>8.4f} {metrics['average_recall_at_1']:>8.4f}")
+
+def evaluate_fields(
+    entries: List[Dict],
+    collected: List[Dict],
+    image_embeddings: List[Optional[np.ndarray]],
+    text_embeddings: List[Optional[np.ndarray]],
+    search: str = RETRIEVAL_SEARCH,
+    precision: str = RETRIEVAL_PRECISION,
+    output_path: str = 'retrieval_results_by_field.json'
+) -> Dict:
+    """Score toutes les requêtes de tous les champs en une passe, puis agrège par champ, par langue et par (champ, langue)."""
+    scored = score_entries(
+        entries, [q['query'] for q in collected], image_embeddings, text_embeddings,
+        search=search, precision=precision, gold_indices=[q['entry_index'] for q in collected]
+    )
+    all_results = [
+        {**result, 'field': q['field'], 'language': q['language']}
+        for q, result in zip(collected, scored) if result
+    ]
+    by_field_language = {}
+    for field in sorted({r['field'] for r in all_results}):
+        by_field_language[field] = _metrics_table([r for r in all_results if r['field'] == field], 'language')
+    output = {
+        'query_results': all_results,
+        'summary': {
+            **(retrieval_metrics(all_results) if all_results else {}),
+            'successful_queries': len(all_results),
+            'failed_queries': len(collected) - len(all_results)
+        },
+        'by_field': _metrics_table(all_results, 'field'),
+        'by_language': _metrics_table(all_results, 'language'),
+        'by_field_language': by_field_language
+    }
+    _print_metrics_table("field", output['by_field'])
+    _print_metrics_table("language", output['by_language'])
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+    return output
+
+def process_and_evaluate_fields(
+    entries: List[Dict],
+    pdf_folder: str,
+    fields: Optional[List[str]] = None,
+    store: Optional[EmbeddingStore] = None,
+    search: str = RETRIEVAL_SEARCH,
+    precision: str = RETRIEVAL_PRECISION
+) -> Dict:
+    """Évalue tous les champs de requêtes en une fois : pages embeddées une seule fois, requêtes par lots."""
+    collected = collect_field_queries(entries, fields)
+    image_embeddings = process_all_images(entries, pdf_folder, store=store, in_store=precision != "float32")
+    text_embeddings = embed_queries([q['query'] for q in collected], store=store)
+    return evaluate_fields(entries, collected, image_embeddings, text_embeddings, search, precision)
+
+async def process_and_evaluate_fields_async(
+    entries: List[Dict],
+    pdf_folder: str,
+    fields: Optional[List[str]] = None,
+    client: AsyncEmbeddingClient = None,
+    store: Optional[EmbeddingStore] = None,
+    search: str = RETRIEVAL_SEARCH,
+    precision: str = RETRIEVAL_PRECISION
+) -> Dict:
+    """Version asynchrone de `process_and_evaluate_fields` : pages et requêtes embeddées en parallèle."""
+    collected = collect_field_queries(entries, fields)
+    owns_client = client is None
+    if owns_client:
+        client = await open_async_client()
+    try:
+        image_embeddings, text_embeddings = await asyncio.gather(
+            process_all_images_async(entries, pdf_folder, client, store, in_store=precision != "float32"),
+            embed_queries_async([q['query'] for q in collected], client, store)
+        )
+    finally:
+        if owns_client:
+            await client.close()
+    return evaluate_fields(entries, collected, image_embeddings, text_embeddings, search, precision)
+
+def evaluate_embeddings(
+    entries: List[Dict],
+    queries: List[Optional[str]],
+    image_embeddings: List[Optional[np.ndarray]],
+    text_embeddings: List[Optional[np.ndarray]],
+    search: str = RETRIEVAL_SEARCH,
+    precision: str = RETRIEVAL_PRECISION
+) -> Dict:
+    all_results = [
+        result for result in score_entries(entries, queries, image_embeddings, text_embeddings, search=search, precision=precision)
+        if result
+    ]
+    return summarize_results(all_results, len(entries))
+
+def compare_precisions(
+    entries: List[Dict],
+    queries: List[Optional[str]],
+    image_embeddings: List[Optional[np.ndarray]],
+    text_embeddings: List[Optional[np.ndarray]]
+) -> Dict[str, Dict[str, float]]:
+    """Écarts de métriques float16 / int8 (avec et sans rescoring) par rapport au float32, sur les mêmes embeddings."""
+    image_matrix, valid_indices = stack_embeddings(image_embeddings)
+    column_of = {int(original): column for column, original in enumerate(valid_indices)}
+    scored = [i for i, query in enumerate(queries) if query and text_embeddings[i] is not None and i in column_of]
+    query_matrix, _ = stack_embeddings([text_embeddings[i] for i in scored])
+    gold_columns = np.array([column_of[i] for i in scored], dtype=np.int64)
+    return precision_report(query_matrix, image_matrix, gold_columns, rescore=RESCORE_DEPTH)
+
+def evaluate_full_corpus(
+    entries: List[Dict],
+    pdf_folder: str,
+    corpus_pages: Optional[List[Tuple[str, int]]] = None,
+    block_size: int = FULL_CORPUS_BLOCK_SIZE,
+    top_k: int = 15,
+    client: EmbeddingBackend = None,
+    store: Optional[EmbeddingStore] = None,
+    output_path: str = 'retrieval_results_full_corpus.json'
+) -> Dict:
+    """
+    Évalue les requêtes des entrées contre tout le corpus (par défaut, toutes les pages de `pdf_folder`)
+    et non plus contre les seules pages échantillonnées. Le corpus est embeddé et scoré par blocs de
+    `block_size` pages : la mémoire reste bornée quel que soit le nombre de pages. Même format de sortie
+    que `evaluate_embeddings`.
+    """
+    client = client or get_default_client()
+    store = store if store is not None else get_default_store(client.image_host)
+    corpus_pages = list(corpus_pages) if corpus_pages is not None else list(iter_pages(count_pdf_pages(pdf_folder)))
+    column_of = {page: column for column, page in enumerate(corpus_pages)}
+    for entry in entries:  # La page attendue doit faire partie du corpus
+        page = (entry['pdf_name'], entry['page_number'])
+        if page not in column_of:
+            column_of[page] = len(corpus_pages)
+            corpus_pages.append(page)
+
+    queries = [entry.get('queries', {}).get('multimodal_query') for entry in entries]
+    gold_embeddings = process_all_images(entries, pdf_folder, client, store)
+    text_embeddings = embed_queries(queries, client, store)
+    scored = [
+        i for i, query in enumerate(queries)
+        if query and text_embeddings[i] is not None and gold_embeddings[i] is not None
+    ]
+    if not scored:
+        return summarize_results([], len(entries), output_path)
+    query_matrix, _ = stack_embeddings([text_embeddings[i] for i in scored])
+    gold_matrix, _ = stack_embeddings([gold_embeddings[i] for i in scored])
+    gold_columns = np.array([column_of[(entries[i]['pdf_name'], entries[i]['page_number'])] for i in scored])
+    top = StreamingTopK(query_matrix, top_k, gold_columns, np.sum(query_matrix * gold_matrix, axis=1))
+
+    known = {(entry['pdf_name'], entry['page_number']): gold_embeddings[i] for i, entry in enumerate(entries)}
+    for start in range(0, len(corpus_pages), block_size):
+        block_pages = corpus_pages[start:start + block_size]
+        missing = [j for j, page in enumerate(block_pages) if page not in known]
+        embedded = process_all_images(
+            [{'pdf_name': block_pages[j][0], 'page_number': block_pages[j][1]} for j in missing],
+            pdf_folder, client, store
+        )
+        block_embeddings = [known.get(page) for page in block_pages]
+        for j, embedding in zip(missing, embedded):
+            block_embeddings[j] = embedding
+        block_matrix, valid = stack_embeddings(block_embeddings)
+        if len(valid):
+            top.update(block_matrix, valid + start)
+        print(f"Scored corpus pages {start}-{start + len(block_pages)} / {len(corpus_pages)}")
+
+    top_indices, top_scores, ranks = top.result()
+    all_results = []
+    for j, i in enumerate(scored):
+        top_pages = [{'pdf_name': corpus_pages[c][0], 'page_number': corpus_pages[c][1]} for c in top_indices[j]]
+        gold_score = float(query_matrix[j] @ gold_matrix[j])
+        all_results.append(_query_result(queries[i], entries[i], ranks[j], gold_score, top_pages, top_scores[j]))
+    return summarize_results(all_results, len(entries), output_path)
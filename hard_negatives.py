@@ -0,0 +1,121 @@
+#hard_negatives.py
+import numpy as np
+from typing import Dict, List, Optional, Sequence
+from config import (
+    RETRIEVAL_SEARCH, HARD_NEGATIVE_DEPTH, HARD_NEGATIVE_MAX_SIMILARITY
+)
+from embeddings import EmbeddingBackend, get_default_client
+from embedding_store import EmbeddingStore, get_default_store
+from evaluation import process_all_images, embed_queries
+from retrieval import stack_embeddings, top_k, QUERY_CHUNK_SIZE
+from ann_index import IVFFlatIndex
+
+FILTER_CHUNK = 256  # Requêtes dont les candidats sont comparés ensemble à leurs pages positives
+
+
+def hard_negative_columns(
+    query_matrix: np.ndarray,
+    corpus_matrix: np.ndarray,
+    positive_columns: np.ndarray,
+    n_negatives: int,
+    depth: int = HARD_NEGATIVE_DEPTH,
+    max_similarity: Optional[float] = HARD_NEGATIVE_MAX_SIMILARITY,
+    search: str = RETRIEVAL_SEARCH,
+    chunk_size: int = QUERY_CHUNK_SIZE
+) -> List[List[int]]:
+    """
+    Les `n_negatives` pages les mieux scorées de chaque requête (lignes normalisées) qui ne sont pas
+    une de ses pages positives (`positive_columns` : une ligne par requête, complétée par -1).
+    Avec `max_similarity`, les pages trop proches d'une page positive (quasi-doublons, donc
+    probablement pertinentes elles aussi) sont écartées. Les candidats viennent des `depth`
+    meilleurs scores, calculés par blocs de requêtes ("exact") ou avec un index IVF ("ann").
+    """
+    depth = min(max(depth, n_negatives + positive_columns.shape[1]), corpus_matrix.shape[0])
+    if search == "ann":
+        candidates, _ = IVFFlatIndex().build(corpus_matrix).search(query_matrix, depth)
+    elif search == "exact":
+        candidates = np.empty((query_matrix.shape[0], depth), dtype=np.int64)
+        for start in range(0, query_matrix.shape[0], chunk_size):
+            candidates[start:start + chunk_size], _ = top_k(query_matrix[start:start + chunk_size] @ corpus_matrix.T, depth)
+    else:
+        raise ValueError(f"Unknown search mode: {search}")
+
+    excluded = candidates < 0  # Places vides d'une recherche ANN
+    excluded |= (candidates[:, :, None] == positive_columns[:, None, :]).any(axis=2)
+    if max_similarity is not None:
+        has_positive = positive_columns >= 0
+        for start in range(0, len(candidates), FILTER_CHUNK):
+            end = start + FILTER_CHUNK
+            similarities = np.einsum(
+                'qcd,qpd->qcp',
+                corpus_matrix[np.maximum(candidates[start:end], 0)],
+                corpus_matrix[np.maximum(positive_columns[start:end], 0)]
+            )
+            similarities[~np.broadcast_to(has_positive[start:end, None, :], similarities.shape)] = -np.inf
+            excluded[start:end] |= similarities.max(axis=2) >= max_similarity
+
+    # Les candidats gardés remontent en tête, dans l'ordre des scores
+    order = np.argsort(excluded, axis=1, kind='stable')[:, :n_negatives]
+    kept = np.take_along_axis(candidates, order, axis=1)
+    kept_valid = ~np.take_along_axis(excluded, order, axis=1)
+    return [row[valid].tolist() for row, valid in zip(kept, kept_valid)]
+
+
+def mine_hard_negatives(
+    queries: Sequence[str],
+    positive_ids: Sequence[str],
+    corpus_ids: Sequence[str],
+    pdf_folder: str,
+    n_negatives: int,
+    depth: int = HARD_NEGATIVE_DEPTH,
+    max_similarity: Optional[float] = HARD_NEGATIVE_MAX_SIMILARITY,
+    search: str = RETRIEVAL_SEARCH,
+    client: EmbeddingBackend = None,
+    store: Optional[EmbeddingStore] = None
+) -> List[List[str]]:
+    """
+    Négatifs difficiles (docids du corpus au format "pdf_page") pour chaque couple (requête, positif).
+    Les pages et requêtes déjà présentes dans le store d'embeddings ne sont pas recalculées.
+    Toutes les pages positives d'une même requête sont exclues de ses négatifs.
+    """
+    client = client or get_default_client()
+    store = store if store is not None else get_default_store(client.image_host)
+    entries = []
+    for docid in corpus_ids:
+        pdf_name, page_number = docid.rsplit('_', 1)
+        entries.append({'pdf_name': pdf_name, 'page_number': int(page_number)})
+
+    print(f"\nEmbedding {len(entries)} corpus pages for hard negative mining...")
+    corpus_matrix, corpus_valid = stack_embeddings(process_all_images(entries, pdf_folder, client, store))
+    unique_queries = list(dict.fromkeys(queries))
+    print(f"Embedding {len(unique_queries)} queries...")
+    query_matrix, query_valid = stack_embeddings(embed_queries(unique_queries, client, store))
+    negatives: List[List[str]] = [[] for _ in queries]
+    if len(corpus_valid) == 0 or len(query_valid) == 0:
+        print("Warning: no embeddings available, no hard negatives mined")
+        return negatives
+
+    column_of = {corpus_ids[i]: column for column, i in enumerate(corpus_valid)}
+    positives: Dict[str, List[int]] = {}
+    for query, positive_id in zip(queries, positive_ids):
+        if positive_id in column_of:
+            positives.setdefault(query, []).append(column_of[positive_id])
+    width = max([len(columns) for columns in positives.values()] + [1])
+    positive_columns = np.full((len(query_valid), width), -1, dtype=np.int64)
+    for row, i in enumerate(query_valid):
+        columns = positives.get(unique_queries[i], [])
+        positive_columns[row, :len(columns)] = columns
+
+    print(f"Mining {n_negatives} hard negatives per query ({search} search)...")
+    columns = hard_negative_columns(
+        query_matrix, corpus_matrix, positive_columns, n_negatives, depth, max_similarity, search
+    )
+    by_query = {
+        unique_queries[i]: [corpus_ids[corpus_valid[column]] for column in query_columns]
+        for i, query_columns in zip(query_valid, columns)
+    }
+    negatives = [list(by_query.get(query, [])) for query in queries]
+    short = sum(len(query_negatives) < n_negatives for query_negatives in negatives)
+    if short:
+        print(f"Warning: {short} queries have fewer than {n_negatives} hard negatives")
+    return negatives
@@ -0,0 +1,109 @@
+#image_utils.py
+import io
+import base64
+from typing import Optional
+from PIL import Image
+from pdf_utils import capture_page_image, capture_page_image_hd
+from config import IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_MAX_EDGE, IMAGE_MAX_BYTES
+
+MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp'
+}
+
+MIN_QUALITY = 30  # Qualité plancher lors de la recherche du budget en octets
+QUALITY_STEP = 10
+DOWNSCALE_FACTOR = 0.75
+
+
+def _normalize_format(image_format: str) -> str:
+    image_format = image_format.upper()
+    if image_format == 'JPG':
+        image_format = 'JPEG'
+    if image_format not in MIME_TYPES:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    return image_format
+
+
+def _resize_to_max_edge(img: Image.Image, max_edge: Optional[int]) -> Image.Image:
+    if not max_edge or max(img.size) <= max_edge:
+        return img
+    scale = max_edge / max(img.size)
+    new_size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(new_size, Image.LANCZOS)
+
+
+def _encode(img: Image.Image, image_format: str, quality: int) -> bytes:
+    buffered = io.BytesIO()
+    if image_format == 'PNG':
+        img.save(buffered, format='PNG', optimize=True)
+    else:
+        img.save(buffered, format=image_format, quality=quality)
+    return buffered.getvalue()
+
+
+def prepare_pil_image(
+    img: Image.Image,
+    image_format: str = IMAGE_FORMAT,
+    quality: int = IMAGE_QUALITY,
+    max_edge: Optional[int] = IMAGE_MAX_EDGE,
+    max_bytes: Optional[int] = IMAGE_MAX_BYTES
+) -> bytes:
+    """
+    Réencode une image pour l'envoi à un LLM : redimensionnement au bord maximal,
+    format et qualité configurables, puis réduction progressive de la qualité
+    (et de la taille si besoin) jusqu'à respecter `max_bytes`.
+    """
+    image_format = _normalize_format(image_format)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    img = _resize_to_max_edge(img, max_edge)
+    data = _encode(img, image_format, quality)
+    if not max_bytes:
+        return data
+
+    # On baisse d'abord la qualité (formats avec pertes), puis on réduit la résolution
+    while len(data) > max_bytes:
+        if image_format != 'PNG' and quality - QUALITY_STEP >= MIN_QUALITY:
+            quality -= QUALITY_STEP
+        elif min(img.size) > 64:
+            img = img.resize(
+                (max(1, int(img.width * DOWNSCALE_FACTOR)), max(1, int(img.height * DOWNSCALE_FACTOR))),
+                Image.LANCZOS
+            )
+        else:
+            print(f"Could not fit image under {max_bytes} bytes, sending {len(data)} bytes")
+            break
+        data = _encode(img, image_format, quality)
+    return data
+
+
+def prepare_image_bytes(image_bytes: bytes, **kwargs) -> bytes:
+    """Réencode une image brute (PNG, JPEG...) selon la configuration d'envoi."""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img.load()
+        return prepare_pil_image(img, **kwargs)
+
+
+def prepare_image_b64(image_bytes: bytes, **kwargs) -> str:
+    """Réencode une image brute et la retourne en base64, prête pour un message LLM."""
+    return base64.b64encode(prepare_image_bytes(image_bytes, **kwargs)).decode('utf-8')
+
+
+def prepare_b64_image(image_b64: str, **kwargs) -> str:
+    """Même chose que `prepare_image_b64` pour une image déjà encodée en base64."""
+    return prepare_image_b64(base64.b64decode(image_b64), **kwargs)
+
+
+def image_data_url(image_b64: str, image_format: str = IMAGE_FORMAT) -> str:
+    """Construit l'URL `data:` avec le type MIME correspondant au format réellement envoyé."""
+    return f"data:{MIME_TYPES[_normalize_format(image_format)]};base64,{image_b64}"
+
+
+def render_page_b64(pdf_path: str, page_number: int, hd: bool = True) -> str:
+    """Rend une page (2x si `hd`, sinon 1x) et la prépare pour l'envoi. Fonction bloquante, à exécuter via `run_blocking`."""
+    image_bytes = capture_page_image_hd(pdf_path, page_number) if hd else capture_page_image(pdf_path, page_number)
+    if image_bytes is None:
+        raise ValueError(f"Could not render page {page_number} of {pdf_path}")
+    return prepare_image_b64(image_bytes)
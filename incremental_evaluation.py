@@ -0,0 +1,205 @@
+#incremental_evaluation.py
+import os
+import json
+import hashlib
+import numpy as np
+from typing import Dict, List, Optional, Set
+from config import (
+    OUTPUT_FILE, PDF_FOLDER, RETRIEVAL_RESULTS_FILE, EVALUATION_STATE_FILE,
+    EVALUATION_SAMPLE_RATE, EVALUATION_SAMPLE_SEED
+)
+from embeddings import EmbeddingBackend, get_default_client
+from embedding_store import EmbeddingStore, get_default_store
+from evaluation import (
+    entry_page_keys, process_all_images, embed_queries, score_entries, summarize_results
+)
+from retrieval import normalize_rows, ndcg_at_k
+from sharding import shard_of
+
+SAMPLE_BUCKETS = 1_000_000
+
+
+def entry_id(entry: Dict) -> str:
+    return f"{entry['pdf_name']}#{entry['page_number']}"
+
+
+def in_sample(entry: Dict, sample_rate: float, seed: int = 0) -> bool:
+    """Appartenance stable à l'échantillon : une entrée ne sort pas de l'échantillon quand le fichier grandit."""
+    if sample_rate >= 1.0:
+        return True
+    return shard_of(entry['pdf_name'], entry['page_number'], SAMPLE_BUCKETS, seed) < sample_rate * SAMPLE_BUCKETS
+
+
+def load_sampled_entries(jsonl_path: str, sample_rate: float, seed: int = 0) -> List[Dict]:
+    """Entrées sans erreur de l'échantillon ; pour une même page, la dernière ligne du fichier l'emporte."""
+    entries = {}
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get('error') is None and in_sample(entry, sample_rate, seed):
+                entries[entry_id(entry)] = entry
+    return list(entries.values())
+
+
+def _fingerprint(query: Optional[str], page_key: Optional[str]) -> str:
+    return hashlib.sha256(json.dumps([query, page_key]).encode('utf-8')).hexdigest()
+
+
+def load_state(state_path: str, settings: Dict) -> Dict:
+    if os.path.exists(state_path):
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('settings') == settings:
+            return state
+        print("Evaluation settings changed, starting from an empty state")
+    return {'settings': settings, 'entries': {}}
+
+
+def save_state(state: Dict, state_path: str):
+    # Écriture atomique : un arrêt pendant la sauvegarde ne corrompt pas l'état précédent
+    os.makedirs(os.path.dirname(state_path) or '.', exist_ok=True)
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, state_path)
+
+
+def _update_rank(result: Dict, query_vector: np.ndarray, added: Dict[str, np.ndarray], removed: Dict[str, np.ndarray],
+                 added_pages: Dict[str, Dict], top_k: int) -> Dict:
+    """Décale le rang de la page attendue et fusionne les nouvelles pages dans le top k, sans rescorer tout le corpus."""
+    gold_score = result['similarity_score']
+    rank = result['recall_position']
+    if removed:
+        rank -= int((np.stack(list(removed.values())) @ query_vector > gold_score).sum())
+    top_matches = list(result['top_15_matches'])
+    if added:
+        added_ids = list(added)
+        scores = np.stack([added[page_id] for page_id in added_ids]) @ query_vector
+        rank += int((scores > gold_score).sum())
+        for page_id, score in zip(added_ids, scores):
+            top_matches.append({**added_pages[page_id], 'similarity_score': float(score)})
+        top_matches = sorted(top_matches, key=lambda match: match['similarity_score'], reverse=True)[:top_k]
+    return {
+        **result,
+        'recall_position': rank,
+        'ndcg_score': float(ndcg_at_k(np.array([rank]), 5)[0]),
+        'recall_at_1': float(rank == 0),
+        'top_15_matches': top_matches
+    }
+
+
+def evaluate_incremental(
+    jsonl_path: str = OUTPUT_FILE,
+    pdf_folder: str = PDF_FOLDER,
+    state_path: str = EVALUATION_STATE_FILE,
+    sample_rate: float = EVALUATION_SAMPLE_RATE,
+    seed: int = EVALUATION_SAMPLE_SEED,
+    field: str = 'multimodal_query',
+    client: EmbeddingBackend = None,
+    store: Optional[EmbeddingStore] = None,
+    output_path: str = RETRIEVAL_RESULTS_FILE,
+    top_k: int = 15
+) -> Dict:
+    """
+    Évaluation incrémentale : seules les entrées ajoutées ou modifiées (requête ou PDF) sont scorées
+    contre le corpus courant. Pour les autres, le rang de la page attendue est mis à jour à partir
+    des seules pages ajoutées ou retirées ; une requête dont le top k contenait une page retirée
+    est rescorée. Les résultats par entrée sont conservés dans `state_path`.
+    """
+    client = client or get_default_client()
+    store = store if store is not None else get_default_store(client.image_host)
+    settings = {'sample_rate': sample_rate, 'seed': seed, 'field': field, 'endpoint': client.image_host}
+    state = load_state(state_path, settings)
+    previous = state['entries']
+
+    entries = load_sampled_entries(jsonl_path, sample_rate, seed)
+    ids = [entry_id(entry) for entry in entries]
+    keys = entry_page_keys(entries, pdf_folder, client.image_host)
+    queries = [(entry.get('queries') or {}).get(field) for entry in entries]
+    fingerprints = [_fingerprint(query, key) for query, key in zip(queries, keys)]
+
+    current_keys = dict(zip(ids, keys))
+    # Une entrée en échec (page non embeddée, ou requête sans résultat) est retentée ; une entrée
+    # sans requête évaluable dont la page est dans le corpus est à jour dès que son empreinte l'est
+    changed = [
+        i for i, page_id in enumerate(ids)
+        if previous.get(page_id, {}).get('fingerprint') != fingerprints[i]
+        or not previous[page_id].get('in_corpus', True)
+        or (queries[i] and not previous[page_id].get('result'))
+    ]
+    changed_set = set(changed)
+    # Une page n'est ajoutée au corpus que si elle est nouvelle, modifiée, ou si son embedding
+    # avait échoué : une entrée sans requête évaluable reste dans le corpus d'un passage à l'autre
+    added_pages = [
+        i for i in changed
+        if previous.get(ids[i], {}).get('page_key') != keys[i] or not previous[ids[i]].get('in_corpus', True)
+    ]
+    removed_pages = {
+        page_id: record['page_key'] for page_id, record in previous.items()
+        if record.get('page_key') and record.get('in_corpus', True) and current_keys.get(page_id, None) != record['page_key']
+    }
+    unchanged = [i for i in range(len(entries)) if i not in changed_set]
+    print(f"Incremental evaluation: {len(entries)} entries, {len(changed)} new or modified, "
+          f"{len(added_pages)} pages added, {len(removed_pages)} pages removed")
+
+    results: Dict[int, Optional[Dict]] = {i: previous[ids[i]]['result'] for i in unchanged}
+    in_corpus = [previous.get(page_id, {}).get('in_corpus', True) for page_id in ids]
+    to_score: List[int] = [i for i in changed if queries[i]]  # Sans requête, rien à scorer
+    if changed or removed_pages:
+        image_embeddings = process_all_images(entries, pdf_folder, client, store)
+        in_corpus = [embedding is not None for embedding in image_embeddings]
+        added = {ids[i]: normalize_rows(image_embeddings[i][None, :])[0] for i in added_pages if image_embeddings[i] is not None}
+        removed = {}
+        for page_id, key in removed_pages.items():
+            vector = store.get(key) if store is not None else None
+            if vector is not None:
+                removed[page_id] = normalize_rows(vector[None, :])[0]
+        # Sans l'ancien vecteur d'une page retirée, les rangs ne peuvent pas être corrigés : tout est rescoré
+        can_update = len(removed) == len(removed_pages)
+        lost: Set[str] = set(removed_pages)
+        scored_before = [i for i in unchanged if results[i]]  # Les entrées sans requête n'ont pas de rang à corriger
+        stale = [
+            i for i in scored_before
+            if not can_update or any(f"{m['pdf_name']}#{m['page_number']}" in lost for m in results[i]['top_15_matches'])
+        ]
+        stale_set = set(stale)
+        updatable = [i for i in scored_before if i not in stale_set]
+        if updatable and (added or removed):
+            query_embeddings = embed_queries([queries[i] for i in updatable], client, store)
+            added_info = {ids[i]: {'pdf_name': entries[i]['pdf_name'], 'page_number': entries[i]['page_number']} for i in added_pages}
+            for i, embedding in zip(updatable, query_embeddings):
+                if embedding is None:
+                    stale.append(i)
+                    continue
+                query_vector = normalize_rows(embedding[None, :])[0]
+                results[i] = _update_rank(results[i], query_vector, added, removed, added_info, top_k)
+        to_score += stale
+
+        if to_score:
+            text_embeddings = embed_queries([queries[i] for i in to_score], client, store)
+            scored = score_entries(
+                entries, [queries[i] for i in to_score], image_embeddings, text_embeddings,
+                top_k=top_k, gold_indices=to_score
+            )
+            for i, result in zip(to_score, scored):
+                results[i] = result
+
+    state['entries'] = {
+        page_id: {'fingerprint': fingerprints[i], 'page_key': keys[i], 'in_corpus': in_corpus[i], 'result': results.get(i)}
+        for i, page_id in enumerate(ids)
+    }
+    save_state(state, state_path)
+    all_results = [results[i] for i in range(len(entries)) if results.get(i)]
+    rescored = set(to_score)
+    print(f"Rescored {len(rescored)} queries, reused {sum(1 for i in unchanged if results.get(i) and i not in rescored)} results")
+    return summarize_results(all_results, len(entries), output_path)
+
+
+if __name__ == "__main__":
+    summary = evaluate_incremental()['summary']
+    print(f"Average Recall Position: {summary['average_recall_position']:.2f}")
+    print(f"Average NDCG: {summary['average_ndcg']:.4f}")
+    print(f"Average Recall@1: {summary['average_recall_at_1']:.4f}")
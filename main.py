@@ -5,9 +5,9 @@ from datetime import datetime
 import json
 import time
 from typing import List, Tuple, Dict
-import base64
 import fitz
-from pdf_utils import capture_page_image_hd
+from image_utils import render_page_b64, image_data_url
+from utils import run_blocking
 import instructor
 from litellm import acompletion
 from pydantic import BaseModel
@@ -382,10 +382,10 @@ async def generate_technical_queries(
                         "content": [
                             {"type": "text", "text": "Generate 3 different technical queries based on the following pages:"},
                             {"type": "image_url", "image_url": {
-                                "url": f"data:image/jpeg;base64,{context_image_b64}"
+                                "url": image_data_url(context_image_b64)
                             }},
                             {"type": "image_url", "image_url": {
-                                "url": f"data:image/jpeg;base64,{page_image_b64}"
+                                "url": image_data_url(page_image_b64)
                             }}
                         ]
                     }
@@ -488,16 +488,14 @@ async def process_pdf(
     output_path: str
 ) -> List[Tuple[int, PDFProcessingResult]]:
     try:
-        context_image = capture_page_image_hd(pdf_path, 0)
-        context_image_b64 = base64.b64encode(context_image).decode('utf-8')
+        context_image_b64 = await run_blocking(render_page_b64, pdf_path, 0)
         
         pdf_document = fitz.open(pdf_path)
         total_pages = len(pdf_document)
         results = []
         
         for page_num in range(1, total_pages):
-            page_image = capture_page_image_hd(pdf_path, page_num)
-            page_image_b64 = base64.b64encode(page_image).decode('utf-8')
+            page_image_b64 = await run_blocking(render_page_b64, pdf_path, page_num)
             
             result = await process_pdf_page(
                 pdf_file,
@@ -4,14 +4,16 @@ import asyncio
 import json
 import time
 import random
-from tqdm import tqdm
 from typing import List, Tuple, Dict
-from config import PDF_FOLDER, OUTPUT_FILE, RETRIEVAL_RESULTS_FILE, RANKED_RESULTS_FILE, GEMINI_API_KEY, REQUESTS_PER_SECOND
-from utils import RateLimiter, process_with_retry, append_result_jsonl
-from pdf_utils import pdf_to_images
+from config import PDF_FOLDER, OUTPUT_FILE, RETRIEVAL_RESULTS_FILE, RANKED_RESULTS_FILE, RANKED_RESULTS_JSONL, RANKING_RESUME, RANKING_COMPACT, GEMINI_API_KEY, REQUESTS_PER_SECOND, SHARD_INDEX, SHARD_COUNT, SHARD_SEED, IN_FLIGHT_IMAGE_BYTES, MAX_CONCURRENT_PDFS, RANKING_MAX_CONCURRENT_QUERIES, PRIORITIZE_PAGES, PRIORITY_TEMPERATURE
+from utils import RateLimiter, ByteBudget, process_with_retry, append_result_jsonl, run_blocking
+from image_utils import render_page_b64
+from sampling import count_pdf_pages, sample_pages, group_pages_by_pdf, write_random_pages_json
+from sharding import filter_shard, shard_output_path
+from scheduling import score_pages, prioritize_pages
 from openai_utils import generate_technical_queries
-from evaluation import load_random_jsonl_entries, process_and_evaluate_entries
-from ranking import PDFRanker
+from evaluation import load_random_jsonl_entries, process_and_evaluate_entries_async
+from ranking import PDFRanker, rerank_queries, ranking_key, load_ranked_results, RankedResultWriter, compact_ranked_results
 import aiofiles
 import litellm
 litellm.set_verbose = True # Activation du mode verbose de litellm pour le débogage
@@ -79,34 +81,57 @@ async def process_pdf_page(
     return result
 
 
+async def render_and_process_pdf_page(
+    pdf_file: str,
+    pdf_path: str,
+    page_num: int,
+    context_image: str,
+    rate_limiter: RateLimiter,
+    output_path: str,
+    byte_budget: ByteBudget
+) -> Tuple[int, PDFProcessingResult]:
+    reserved = await byte_budget.acquire(byte_budget.estimate()) # Attend que le budget mémoire permette un nouveau rendu
+    try:
+        try:
+            page_image = await run_blocking(render_page_b64, pdf_path, page_num, False)
+        except Exception as e:
+            print(f"Error rendering page {page_num} of {pdf_file}: {str(e)}")
+            return page_num, PDFProcessingResult(pdf_name=pdf_file, processed_pages=[page_num], error=str(e))
+        reserved = await byte_budget.adjust(reserved, len(page_image))
+        return await process_pdf_page(pdf_file, page_num, context_image, page_image, rate_limiter, output_path)
+    finally:
+        await byte_budget.release(reserved) # Libère l'image une fois la requête terminée
+
+
 async def process_pdf(
     pdf_file: str,
     pdf_path: str,
     rate_limiter: RateLimiter,
     output_path: str,
-    selected_pages: List[int]
+    selected_pages: List[int],
+    byte_budget: ByteBudget
 ) -> List[Tuple[int, PDFProcessingResult]]:
+    context_bytes = 0
     try:
-        page_images = pdf_to_images(pdf_path)
-        context_image = page_images[0][1]
+        # Le rendu se fait dans l'executor : la boucle continue de traiter les réponses de l'API
+        context_image = await run_blocking(render_page_b64, pdf_path, 0, False)
+        context_bytes = await byte_budget.charge(len(context_image)) # Gardée en mémoire pendant tout le PDF
         results = []
         chunk_size = 5
 
-        # Filter images based on selected pages (ne traite que les pages sélectionnées)
-        selected_page_images = [img for img in page_images if img[0] in selected_pages]
-
-        for i in range(0, len(selected_page_images), chunk_size):
-            chunk = selected_page_images[i:i + chunk_size]
+        for i in range(0, len(selected_pages), chunk_size):
+            chunk = selected_pages[i:i + chunk_size]
             chunk_tasks = []
-            for page_num, page_image in chunk:
-                task = asyncio.create_task(  # Création d'une tâche asynchrone pour chaque page
-                    process_pdf_page(
+            for page_num in chunk:
+                task = asyncio.create_task(  # Création d'une tâche asynchrone pour chaque page (rendu puis requête)
+                    render_and_process_pdf_page(
                         pdf_file,
+                        pdf_path,
                         page_num,
                         context_image,
-                        page_image,
                         rate_limiter,
-                        output_path
+                        output_path,
+                        byte_budget
                     )
                 )
                 chunk_tasks.append(task)
@@ -131,67 +156,81 @@ async def process_pdf(
             output_path
         )
         return error_result
+    finally:
+        await byte_budget.release(context_bytes, held=False)
+
+
+async def process_pdf_bounded(pdf_semaphore: asyncio.Semaphore, *args) -> List[Tuple[int, PDFProcessingResult]]:
+    async with pdf_semaphore:
+        return await process_pdf(*args)
 
 
-async def create_random_pages_json(folder_path: str, num_pages: int = 500, output_file: str = "random_pages.json") -> Dict[str, List[int]]:
+async def create_random_pages_json(
+    folder_path: str,
+    num_pages: int = 500,
+    output_file: str = "random_pages.json",
+    seed: int = None,
+    stratify_by: str = None
+) -> Dict[str, List[int]]:
     """
     Génère un fichier JSON contenant une liste de numéros de page aléatoires pour chaque PDF,
     totalisant environ `num_pages` sur tous les PDFs.
+    Le tirage se fait en une passe à partir du nombre de pages de chaque PDF, sans rendu.
 
     Args:
         folder_path: Chemin vers le dossier contenant les fichiers PDF.
         num_pages: Nombre total de pages aléatoires à sélectionner sur tous les PDFs.
         output_file: Nom du fichier JSON de sortie.
+        seed: Graine pour un tirage reproductible.
+        stratify_by: None, 'pdf' ou 'language' (voir `sampling.sample_pages`).
     """
-    pdf_files = [f for f in os.listdir(folder_path) if f.lower().endswith('.pdf')]
-    all_pages = [] # Liste pour stocker tous les tuples (pdf_file, page_number)
-
-    for pdf_file in pdf_files:
-        pdf_path = os.path.join(folder_path, pdf_file)
-        try:
-            page_images = pdf_to_images(pdf_path) # Récupère toutes les pages d'un PDF
-            for page_num, _ in page_images: # Ajoute chaque page dans la liste all_pages avec son nom de pdf
-                all_pages.append((pdf_file, page_num))
-        except Exception as e:
-             print(f"Error processing {pdf_file}: {str(e)}")
-    
-    if len(all_pages) == 0:
+    page_counts = count_pdf_pages(folder_path) # Nombre de pages par PDF, sans rendu
+    if sum(page_counts.values()) == 0:
       print("No pages found in any PDF")
       return {}
-    
-    num_pages_to_select = min(num_pages, len(all_pages)) # Sélectionne le nombre de pages à traiter (maximum num_pages)
-    selected_pages = random.sample(all_pages, num_pages_to_select) # Choisi aléatoirement les pages à traiter
 
-    random_pages = {} # Dictionnaire pour stocker les pages sélectionnées par pdf
-    for pdf_file, page_num in selected_pages:
-        if pdf_file not in random_pages:
-            random_pages[pdf_file] = []
-        random_pages[pdf_file].append(page_num)
-    
-    for pdf_file in random_pages:
-      random_pages[pdf_file] = sorted(random_pages[pdf_file]) # Trie les numéros de page
-    
-    with open(output_file, 'w', encoding='utf-8') as f:  # Écrit les résultats dans un fichier JSON
-        json.dump(random_pages, f, indent=2)
-    
+    selected_pages = sample_pages(page_counts, num_pages, seed=seed, stratify_by=stratify_by) # Tirage par réservoir
+    random_pages = group_pages_by_pdf(selected_pages) # Regroupe et trie les pages par pdf
+    write_random_pages_json(random_pages, output_file) # Écrit les résultats dans un fichier JSON
+
     print(f"Created random pages JSON file: {output_file}")
     return random_pages
 
 
-async def process_pdf_folder(folder_path: str, output_path: str, random_pages: Dict[str, List[int]], num_query_pages: int = 100) -> Dict[str, List[Tuple[int, PDFProcessingResult]]]:
+async def process_pdf_folder(
+    folder_path: str,
+    output_path: str,
+    random_pages: Dict[str, List[int]],
+    num_query_pages: int = 100,
+    shard_index: int = 0,
+    shard_count: int = 1,
+    seed: int = None,
+    prioritize: bool = False,
+    temperature: float = 0.0,
+    byte_budget: ByteBudget = None
+) -> Dict[str, List[Tuple[int, PDFProcessingResult]]]:
     """
     Traite les PDF du dossier en sélectionnant aléatoirement des pages pour les requêtes.
         folder_path: Chemin vers le dossier contenant les fichiers PDF.
         output_path: Chemin du fichier de sortie jsonl.
         random_pages: dictionnaire contenant les 500 pages sélectionnées pour le traitement.
         num_query_pages: le nombre de pages pour lesquelles les requêtes seront générées.
+        shard_index, shard_count: ne traite que les pages (pdf, page) dont le hash tombe dans ce shard.
+        seed: graine du tirage des pages et du partitionnement, identique sur tous les shards.
+        prioritize: choisit les pages les plus prometteuses (voir `scheduling.page_priority_score`) plutôt qu'au hasard.
+        temperature: température du tirage par priorité (0 = ordre strict), pour garder de la diversité.
+        byte_budget: budget mémoire partagé des images en vol (IN_FLIGHT_IMAGE_BYTES par défaut).
     """
     results = {}
     pdf_files = [f for f in os.listdir(folder_path) if f.lower().endswith('.pdf')]
     async with aiofiles.open(output_path, 'w', encoding='utf-8') as f: # Ouvre le fichier de sortie en mode ecriture
         await f.write('') # vide le fichier si il existe
     rate_limiter = RateLimiter(requests_per_second=REQUESTS_PER_SECOND)
+    if byte_budget is None:
+        byte_budget = ByteBudget(IN_FLIGHT_IMAGE_BYTES)
+    pdf_semaphore = asyncio.Semaphore(MAX_CONCURRENT_PDFS) # Limite le nombre d'images de contexte gardées en mémoire
     tasks = [] # Liste pour stocker toutes les tâches asynchrones
+    task_pdf_files = [] # PDF correspondant à chaque tâche
     
     # Préparation des pages à traiter
     all_selected_pages = [] # liste temporaire des pages pour la sélection des 100 pages
@@ -200,29 +239,43 @@ async def process_pdf_folder(folder_path: str, output_path: str, random_pages: D
             all_selected_pages.append((pdf_file, page)) # Ajout du tuple (pdf_file, page) à la liste
     
     num_query_pages = min(num_query_pages, len(all_selected_pages)) # Sélection du nombre max de pages pour le traitement des queries
-    query_pages = random.sample(all_selected_pages, num_query_pages) # Selectionne aléatoirement les pages à traiter pour les queries
+    rng = random.Random(seed) if seed is not None else random # Tirage reproductible : tous les shards voient la même sélection
+    if prioritize: # Les pages les plus susceptibles de produire des requêtes valides passent en premier
+        page_scores = score_pages(folder_path, all_selected_pages)
+        query_pages = prioritize_pages(page_scores, temperature, seed)[:num_query_pages]
+    else:
+        query_pages = rng.sample(all_selected_pages, num_query_pages) # Selectionne aléatoirement les pages à traiter pour les queries
     query_pages_dict = {} # Dictionnaire pour stocker les pages à traiter pour les queries
     for pdf_file, page in query_pages: # Remplit query_pages_dict avec les pdfs comme clé, et les pages comme valeur
       if pdf_file not in query_pages_dict:
           query_pages_dict[pdf_file] = []
       query_pages_dict[pdf_file].append(page)
+    if shard_count > 1: # Ne garde que la part de ce shard
+        query_pages_dict = filter_shard(query_pages_dict, shard_index, shard_count, seed or 0)
+        print(f"Shard {shard_index}/{shard_count}: {sum(len(p) for p in query_pages_dict.values())} pages to process")
     
     for pdf_file in pdf_files: # Pour chaque fichier pdf
       pdf_path = os.path.join(folder_path, pdf_file)
       selected_pages = random_pages.get(pdf_file, []) # récupère la liste des pages sélectionnées pour ce pdf
       if selected_pages: # si la liste des pages n'est pas vide
             if pdf_file in query_pages_dict:  # si ce pdf contient des pages qui doivent être traitées pour les queries
-              tasks.append(process_pdf( # Appel de la fonction process_pdf uniquement si la condition précédente est vraie
+              tasks.append(process_pdf_bounded( # Appel de la fonction process_pdf uniquement si la condition précédente est vraie
+                pdf_semaphore,
                 pdf_file,
                 pdf_path,
                 rate_limiter,
                 output_path,
-                query_pages_dict[pdf_file]
+                query_pages_dict[pdf_file],
+                byte_budget
             ))
+              task_pdf_files.append(pdf_file)
     pdf_results = await asyncio.gather(*tasks) # Attend que toutes les tâches soient terminées
-    for pdf_file, result in zip(pdf_files, pdf_results):
+    for pdf_file, result in zip(task_pdf_files, pdf_results):
         if pdf_file in random_pages:  #  ne sauvegarde le résultat que si le pdf fait parti de la liste de ceux contenant les 500 pages
             results[pdf_file] = result
+    budget_stats = byte_budget.stats()
+    print(f"In-flight image memory: peak {budget_stats['peak_bytes'] / 1e6:.1f} MB "
+          f"(budget {budget_stats['max_bytes'] / 1e6:.1f} MB)")
     return results
 
 
@@ -230,10 +283,24 @@ async def main():
     try:
         print("\n=== Starting Program ===")
         print("Creating random pages JSON...")
-        random_pages = await create_random_pages_json(PDF_FOLDER) # Génère les 500 pages aléatoires
+        sharded = SHARD_COUNT > 1
+        random_pages = await create_random_pages_json( # Génère les 500 pages aléatoires (identiques sur tous les shards)
+            PDF_FOLDER,
+            seed=SHARD_SEED if sharded else None
+        )
         
         print("Starting PDF processing...")
-        results = await process_pdf_folder(PDF_FOLDER, OUTPUT_FILE, random_pages)  # Traite les PDFs avec la liste des 500 pages, et sélectionne 100 pages pour les queries.
+        output_file = shard_output_path(OUTPUT_FILE, SHARD_INDEX, SHARD_COUNT) if sharded else OUTPUT_FILE
+        results = await process_pdf_folder(  # Traite les PDFs avec la liste des 500 pages, et sélectionne 100 pages pour les queries.
+            PDF_FOLDER,
+            output_file,
+            random_pages,
+            shard_index=SHARD_INDEX,
+            shard_count=SHARD_COUNT,
+            seed=SHARD_SEED if sharded else None,
+            prioritize=PRIORITIZE_PAGES,
+            temperature=PRIORITY_TEMPERATURE
+        )
         total_pdfs = len(results)
         total_pages = sum(len(page_results) for page_results in results.values()) # Compte le nombre total de pages traitées
         successful_pages = sum(
@@ -241,10 +308,14 @@ async def main():
             for page_results in results.values()
         )
         print(f"Processed {total_pdfs} PDFs with {total_pages} pages, {successful_pages} successful pages")
+        if sharded: # L'évaluation et le ranking se font sur la sortie fusionnée
+            print(f"Shard output saved to {output_file}")
+            print(f"Merge shards with: python sharding.py {OUTPUT_FILE} --shard-count {SHARD_COUNT}")
+            return
         print("Starting evaluation...")
         entries = load_random_jsonl_entries(OUTPUT_FILE) # Charge les données pour l'évaluation
         print(f"Loaded {len(entries)} random entries for evaluation")
-        evaluation_results = process_and_evaluate_entries(entries, PDF_FOLDER) # Évalue les résultats
+        evaluation_results = await process_and_evaluate_entries_async(entries, PDF_FOLDER) # Évalue les résultats
         print(f"Evaluation Results:")
         print(f"Average Recall Position: {evaluation_results['summary']['average_recall_position']:.2f}")
         print(f"Average NDCG: {evaluation_results['summary']['average_ndcg']:.4f}")
@@ -259,64 +330,38 @@ async def main():
         queries_to_process = retrieval_data['query_results'] # Récupère les données à traiter
         total_queries = len(queries_to_process)
         print(f"\n=== Processing {total_queries} queries for ranking ===")
-        results_data = []
-        for query_index, query_result in enumerate(tqdm(queries_to_process, desc="Ranking Queries"), 1): # Parcourt toutes les queries
-            query_results = {
-                "query": query_result.get('query', ''),
-                "ranked_documents": []
-            }
-            pdfs_to_analyze = []
-            for match in query_result.get('top_15_matches', []): # Parcourt les 15 top matchs
-                pdf_name = match.get('pdf_name')
-                page_number = match.get('page_number')
-                if pdf_name and pdf_name.strip() and page_number is not None: # verifie que le pdf_name n'est pas vide et que page_number n'est pas null
-                    pdf_path = os.path.join(PDF_FOLDER, pdf_name)
-                    if os.path.exists(pdf_path):
-                        pdfs_to_analyze.append((pdf_path, page_number))
-            if not pdfs_to_analyze:
-                print(f"No valid PDFs found for query {query_index}")
-                continue
-            try:
-                pages_data = []
-                for pdf_path, page_num in pdfs_to_analyze: # Parcourt la liste des pdf à analyser
-                    if not pdf_path:
-                        print(f"Empty PDF path received, skipping. Query {query_index}")
-                        continue
-                    try:
-                        data = await ranker.analyze_specific_page(pdf_path, page_num) # Analyse la page specifique
-                        if data[2]:
-                            pages_data.append(data)
-                    except Exception as e:
-                        print(f"Error processing {os.path.basename(pdf_path)}: {str(e)}")
-                if not pages_data:
-                    print("No valid page data extracted")
-                    continue
-                initial_results = await ranker.process_batch(pages_data, query_result['query'])
-                if not initial_results:
-                    print("No results from Gemini processing")
-                    continue
-                ranked_results = await ranker.analyze_and_rank_documents(query_result['query'], initial_results) # Analyse et ordonne les résultats
-                for i, doc in enumerate(ranked_results.top_documents, 1):
-                    query_results["ranked_documents"].append({
-                        "rank": i,
-                        "file_name": doc.file_name,
-                        "page": doc.page_number
-                    })
-
-                output_dir = os.path.dirname(RANKED_RESULTS_FILE)
-                if output_dir and output_dir != '':
-                    os.makedirs(output_dir, exist_ok=True)
-                else:
-                     print(f"Invalid directory: {output_dir}")
+        output_dir = os.path.dirname(RANKED_RESULTS_JSONL)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        if RANKING_RESUME:
+            already_ranked = load_ranked_results(RANKED_RESULTS_JSONL)
+        else:
+            already_ranked = {}
+            open(RANKED_RESULTS_JSONL, 'w', encoding='utf-8').close()
+        # Une même requête avec les mêmes candidats n'est classée qu'une fois ; la compaction la réécrit pour chaque résultat
+        pending_by_key = {}
+        for q in queries_to_process:
+            key = ranking_key(q)
+            if key not in already_ranked and key not in pending_by_key:
+                pending_by_key[key] = q
+        pending_keys = list(pending_by_key)
+        pending_queries = list(pending_by_key.values())
+        if already_ranked:
+            resumed = sum(1 for q in queries_to_process if ranking_key(q) in already_ranked)
+            print(f"Resuming: {resumed} queries already ranked in {RANKED_RESULTS_JSONL}")
 
-                print("Saving current results...")
-                results_data.append(query_results)
-                with open(RANKED_RESULTS_FILE, 'w', encoding='utf-8') as f: # Sauvegarde les resultats
-                    json.dump(results_data, f, indent=2, ensure_ascii=False)
-                print(f"Results saved to: {RANKED_RESULTS_FILE}")
-            except Exception as e:
-                print(f"Error processing query {query_index}: {str(e)}")
-                continue
+        async with RankedResultWriter(RANKED_RESULTS_JSONL) as writer: # Écritures hors de la boucle d'événements
+            results_data = await rerank_queries( # Plusieurs requêtes classées en parallèle, rate limit partagé
+                ranker, pending_queries, PDF_FOLDER,
+                max_in_flight=RANKING_MAX_CONCURRENT_QUERIES,
+                on_result=lambda index, query_results: writer.write({**query_results, "key": pending_keys[index]})
+            )
+        print(f"Ranked {len(results_data)}/{len(pending_queries)} queries, results appended to: {RANKED_RESULTS_JSONL}")
+        if RANKING_COMPACT:
+            count = compact_ranked_results(
+                RANKED_RESULTS_JSONL, RANKED_RESULTS_FILE, queries_to_process
+            )
+            print(f"Compacted {count} ranked queries into: {RANKED_RESULTS_FILE}")
     except Exception as e:
         print(f"Fatal error: {str(e)}")
     finally:
@@ -7,6 +7,7 @@ import logging
 from typing import List, Optional
 from config import GEMINI_API_KEY
 from utils import RateLimiter
+from image_utils import image_data_url
 import asyncio
 
 class TechnicalQueries(BaseModel):
@@ -69,10 +70,10 @@ async def generate_technical_queries(
                         "content": [
                             {"type": "text", "text": "Generate 3 different technical queries based on the following pages:"},
                             {"type": "image_url", "image_url": {
-                                "url": f"data:image/jpeg;base64,{context_image_b64}"
+                                "url": image_data_url(context_image_b64)
                             }},
                             {"type": "image_url", "image_url": {
-                                "url": f"data:image/jpeg;base64,{detail_image_b64}"
+                                "url": image_data_url(detail_image_b64)
                             }}
                         ]
                     }
@@ -0,0 +1,110 @@
+#page_cache.py
+import os
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from config import PAGE_CACHE_MAX_BYTES, PAGE_CACHE_DIR, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_MAX_EDGE, IMAGE_MAX_BYTES
+
+
+def render_settings(zoom: float) -> Tuple:
+    """Paramètres qui changent l'image produite : une modification invalide les entrées du cache."""
+    return (zoom, IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_MAX_EDGE, IMAGE_MAX_BYTES)
+
+
+class PageImageCache:
+    """
+    Cache des images de pages préparées (base64), clé (pdf, taille, mtime, page, paramètres de rendu).
+    Tier mémoire LRU borné en octets, tier disque optionnel. Les rendus simultanés d'une même page
+    sont partagés : une page demandée par plusieurs requêtes en vol n'est rendue qu'une fois.
+    """
+    def __init__(self, max_bytes: int = PAGE_CACHE_MAX_BYTES, directory: Optional[str] = PAGE_CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._items: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._pending: Dict[Tuple, asyncio.Future] = {}
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def key(self, pdf_path: str, page_num: int, settings: Tuple) -> Tuple:
+        stat = os.stat(pdf_path)
+        return (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime, page_num, settings)
+
+    def _disk_path(self, key: Tuple) -> str:
+        return os.path.join(self.directory, hashlib.sha256(repr(key).encode('utf-8')).hexdigest() + ".b64")
+
+    def _remember(self, key: Tuple, image_b64: str):
+        if key in self._items:
+            return
+        self._items[key] = image_b64
+        self._bytes += len(image_b64)
+        while self._bytes > self.max_bytes and self._items:
+            _, evicted = self._items.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.stats["evictions"] += 1
+
+    def get(self, key: Tuple) -> Optional[str]:
+        if key in self._items:
+            self._items.move_to_end(key)
+            self.stats["hits"] += 1
+            return self._items[key]
+        if self.directory:
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                with open(path, 'r', encoding='ascii') as f:
+                    image_b64 = f.read()
+                self._remember(key, image_b64)
+                self.stats["disk_hits"] += 1
+                return image_b64
+        return None
+
+    def put(self, key: Tuple, image_b64: str):
+        self._remember(key, image_b64)
+        if self.directory:
+            path = self._disk_path(key)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'w', encoding='ascii') as f:
+                f.write(image_b64)
+            os.replace(tmp_path, path)
+
+    async def get_or_render(self, key: Tuple, render: Callable[[], Awaitable[str]]) -> str:
+        """Image en cache, ou rendue par `render()` (les rendus vides, en échec, ne sont pas mis en cache)."""
+        image_b64 = self.get(key)
+        if image_b64 is not None:
+            return image_b64
+        if key in self._pending:
+            self.stats["hits"] += 1
+            pending = self._pending[key]
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise  # C'est cette requête qui est annulée
+                return await self.get_or_render(key, render)  # Rendu partagé annulé : on le relance
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            image_b64 = await render()
+            if image_b64:
+                self.put(key, image_b64)
+            future.set_result(image_b64)
+            return image_b64
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Marque l'exception comme récupérée si personne n'attendait ce rendu
+            raise
+        finally:
+            # Rendu annulé (CancelledError n'est pas une Exception) : les requêtes en attente sont libérées
+            if not future.done():
+                future.cancel()
+            del self._pending[key]
+
+    def summary(self) -> str:
+        lookups = self.stats["hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hit_rate = (self.stats["hits"] + self.stats["disk_hits"]) / lookups if lookups else 0.0
+        return (f"Page cache: {self.stats['hits']} hits, {self.stats['disk_hits']} disk hits, "
+                f"{self.stats['misses']} misses ({hit_rate:.1%} hit rate), {len(self._items)} images, "
+                f"{self._bytes / 1e6:.1f} MB, {self.stats['evictions']} evictions")
@@ -0,0 +1,195 @@
+#quantization.py
+import numpy as np
+from typing import Dict, Optional, Tuple, Sequence, Union
+from retrieval import normalize_rows, top_k, gold_ranks, ndcg_at_k, recall_at_k, QUERY_CHUNK_SIZE
+
+PRECISIONS = ("float32", "float16", "int8")
+SCORE_BLOCK_ROWS = 16384  # Lignes décompressées à la fois pour le scoring int8
+RESCORE_CHUNK = 64  # Requêtes dont les candidats sont rescorés ensemble
+
+
+class QuantizedMatrix:
+    """
+    Matrice d'embeddings normalisés stockée en précision réduite : float16, ou int8 avec une
+    échelle par vecteur (x ≈ codes * scale). Le scoring se fait par blocs de lignes, sans
+    reconstruire la matrice complète en float32.
+    """
+    def __init__(self, data: np.ndarray, scales: Optional[np.ndarray], precision: str):
+        self.data = data
+        self.scales = scales
+        self.precision = precision
+
+    @classmethod
+    def from_matrix(cls, matrix: np.ndarray, precision: str = "float16") -> 'QuantizedMatrix':
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+        matrix = normalize_rows(matrix)
+        if precision == "int8":
+            scales = np.abs(matrix).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+            return cls(codes, scales.astype(np.float32), precision)
+        return cls(matrix.astype(precision), None, precision)
+
+    @classmethod
+    def _from_blocks(cls, n_rows: int, dim: int, precision: str, block_rows: int, get_block) -> 'QuantizedMatrix':
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision: {precision}")
+        data = np.empty((n_rows, dim), dtype=np.int8 if precision == "int8" else precision)
+        scales = np.empty(n_rows, dtype=np.float32) if precision == "int8" else None
+        for start in range(0, n_rows, block_rows):
+            end = min(start + block_rows, n_rows)
+            block = cls.from_matrix(get_block(start, end), precision)
+            data[start:end] = block.data
+            if scales is not None:
+                scales[start:end] = block.scales
+        return cls(data, scales, precision)
+
+    @classmethod
+    def from_matrix_rows(cls, matrix: np.ndarray, rows: np.ndarray, precision: str = "float16", block_rows: int = SCORE_BLOCK_ROWS) -> 'QuantizedMatrix':
+        """Quantifie les lignes `rows` de `matrix` (par ex. la memmap float16 du store) par blocs."""
+        rows = np.asarray(rows, dtype=np.int64)
+        return cls._from_blocks(len(rows), matrix.shape[1], precision, block_rows, lambda start, end: matrix[rows[start:end]])
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[np.ndarray], precision: str = "float16", block_rows: int = SCORE_BLOCK_ROWS) -> 'QuantizedMatrix':
+        """Comme `from_matrix`, à partir d'une liste de vecteurs quantifiés par blocs, sans matrice float32 complète."""
+        dim = np.asarray(rows[0]).size if len(rows) else 0
+        return cls._from_blocks(
+            len(rows), dim, precision, block_rows,
+            lambda start, end: np.stack([np.asarray(row, dtype=np.float32).reshape(-1) for row in rows[start:end]])
+        )
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.data.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def scores(self, query_matrix: np.ndarray) -> np.ndarray:
+        """Scores requêtes x lignes (float32), calculés par blocs de lignes."""
+        scores = np.empty((query_matrix.shape[0], self.data.shape[0]), dtype=np.float32)
+        for start in range(0, self.data.shape[0], SCORE_BLOCK_ROWS):
+            end = min(start + SCORE_BLOCK_ROWS, self.data.shape[0])
+            block = query_matrix @ self.data[start:end].astype(np.float32).T
+            scores[:, start:end] = block * self.scales[start:end] if self.scales is not None else block
+        return scores
+
+
+class EmbeddingRows:
+    """
+    Lignes normalisées en float32 lues à la demande (`rows[indices]`, indices de forme quelconque) :
+    le rescoring ne charge que les candidats. La source est une matrice (par ex. la memmap float16
+    du store) dont `rows` donne la ligne de chaque colonne, ou à défaut une liste de vecteurs.
+    """
+    def __init__(self, source, rows: Optional[np.ndarray] = None):
+        self.source = source
+        self.rows = None if rows is None else np.asarray(rows, dtype=np.int64)
+        if self.rows is not None:
+            self.dim = source.shape[1]
+        else:
+            self.dim = np.asarray(source[0]).size if len(source) else 0
+
+    def __len__(self) -> int:
+        return len(self.rows) if self.rows is not None else len(self.source)
+
+    def __getitem__(self, indices) -> np.ndarray:
+        indices = np.asarray(indices)
+        if indices.size == 0:
+            return np.zeros(indices.shape + (self.dim,), dtype=np.float32)
+        if self.rows is not None:
+            rows = self.source[self.rows[indices.ravel()]]
+        else:
+            rows = np.stack([np.asarray(self.source[i], dtype=np.float32).reshape(-1) for i in indices.ravel()])
+        return normalize_rows(rows).reshape(indices.shape + (self.dim,))
+
+
+def quantized_score_queries(
+    query_matrix: np.ndarray,
+    quantized: QuantizedMatrix,
+    full_matrix: Optional[Union[np.ndarray, EmbeddingRows]],
+    gold_columns: np.ndarray,
+    k: int = 15,
+    rescore: int = 100,
+    chunk_size: int = QUERY_CHUNK_SIZE
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Même sortie que `retrieval.score_queries` : scoring en précision réduite, puis les `rescore`
+    meilleurs candidats sont rescorés en pleine précision avec `full_matrix` (si fournie : matrice
+    normalisée, ou `EmbeddingRows` pour ne lire que les lignes des candidats).
+    Le rang de la page attendue est exact si elle figure parmi ces candidats, approché sinon.
+    """
+    n_queries = query_matrix.shape[0]
+    k = min(k, quantized.shape[0])
+    top_indices = np.zeros((n_queries, k), dtype=np.int64)
+    top_scores = np.zeros((n_queries, k), dtype=np.float32)
+    ranks = np.zeros(n_queries, dtype=np.int64)
+    scores_of_gold = np.zeros(n_queries, dtype=np.float32)
+    for start in range(0, n_queries, chunk_size):
+        end = min(start + chunk_size, n_queries)
+        queries, gold = query_matrix[start:end], gold_columns[start:end]
+        scores = quantized.scores(queries)
+        approx_ranks, approx_gold = gold_ranks(scores, gold)
+        if full_matrix is None:
+            top_indices[start:end], top_scores[start:end] = top_k(scores, k)
+            ranks[start:end], scores_of_gold[start:end] = approx_ranks, approx_gold
+            continue
+        candidates, _ = top_k(scores, max(k, rescore))
+        exact = np.empty(candidates.shape, dtype=np.float32)
+        for sub in range(0, len(queries), RESCORE_CHUNK):  # Borne la copie des candidats en pleine précision
+            exact[sub:sub + RESCORE_CHUNK] = np.einsum(
+                'qd,qcd->qc', queries[sub:sub + RESCORE_CHUNK], full_matrix[candidates[sub:sub + RESCORE_CHUNK]]
+            )
+        order = np.lexsort((-candidates, -exact), axis=1)
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        exact = np.take_along_axis(exact, order, axis=1)
+        top_indices[start:end], top_scores[start:end] = candidates[:, :k], exact[:, :k]
+        found = candidates == gold[:, None]
+        ranks[start:end] = np.where(found.any(axis=1), found.argmax(axis=1), approx_ranks)
+        scores_of_gold[start:end] = np.sum(queries * full_matrix[gold], axis=1)
+    return top_indices, top_scores, ranks, scores_of_gold
+
+
+def precision_report(
+    query_matrix: np.ndarray,
+    corpus_matrix: np.ndarray,
+    gold_columns: np.ndarray,
+    precisions: Sequence[str] = PRECISIONS,
+    k: int = 15,
+    rescore: int = 100
+) -> Dict[str, Dict[str, float]]:
+    """
+    Compare les métriques de retrieval (rang moyen, NDCG@5, recall@1, recouvrement du top k)
+    et la mémoire de chaque précision, avec et sans rescoring, par rapport au float32.
+    """
+    precisions = ["float32"] + [precision for precision in precisions if precision != "float32"]
+    query_matrix = normalize_rows(query_matrix)
+    corpus_matrix = normalize_rows(corpus_matrix)
+    reference = None
+    report = {}
+    for precision in precisions:
+        quantized = QuantizedMatrix.from_matrix(corpus_matrix, precision)
+        variants = [(precision, None)] if precision == "float32" else [(precision, None), (f"{precision}+rescore", corpus_matrix)]
+        for name, full_matrix in variants:
+            indices, _, ranks, _ = quantized_score_queries(query_matrix, quantized, full_matrix, gold_columns, k, rescore)
+            metrics = {
+                'memory_bytes': quantized.nbytes,
+                'average_recall_position': float(np.mean(ranks)),
+                'average_ndcg': float(np.mean(ndcg_at_k(ranks, 5))),
+                'average_recall_at_1': float(np.mean(recall_at_k(ranks, 1)))
+            }
+            if reference is None:
+                reference = (indices, metrics)
+            overlap = [len(set(a) & set(b)) / max(1, len(a)) for a, b in zip(reference[0], indices)]
+            metrics['top_k_overlap'] = float(np.mean(overlap))
+            for metric in ('average_recall_position', 'average_ndcg', 'average_recall_at_1'):
+                metrics[f'delta_{metric}'] = metrics[metric] - reference[1][metric]
+            report[name] = metrics
+    for name, metrics in report.items():
+        print(f"{name:>16}: {metrics['memory_bytes'] / 1e6:8.1f} MB | "
+              f"NDCG {metrics['average_ndcg']:.4f} ({metrics['delta_average_ndcg']:+.4f}) | "
+              f"R@1 {metrics['average_recall_at_1']:.4f} ({metrics['delta_average_recall_at_1']:+.4f}) | "
+              f"top-{k} overlap {metrics['top_k_overlap']:.3f}")
+    return report
@@ -2,13 +2,15 @@ import os
 import asyncio
 import aiofiles
 import json
-import base64
 import fitz
 from datetime import datetime
 from pydantic import BaseModel
 import instructor
 from litellm import Field, acompletion
-from pdf_utils import capture_page_image_hd
+from image_utils import render_page_b64, image_data_url
+from sampling import count_pdf_pages, sample_pages, iter_random_pages
+from utils import TargetTracker, run_blocking
+from scheduling import score_pages, prioritize_pages, iter_prioritized_pages
 import random
 
 class TechnicalQueries(BaseModel):
@@ -66,8 +68,8 @@ async def generate_queries(context_image_b64: str, page_image_b64: str) -> Techn
                     "role": "user",
                     "content": [
                         {"type": "text", "text": "Generate a technical query based on these pages:"},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{context_image_b64}"}},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{page_image_b64}"}}
+                        {"type": "image_url", "image_url": {"url": image_data_url(context_image_b64)}},
+                        {"type": "image_url", "image_url": {"url": image_data_url(page_image_b64)}}
                     ]
                 }
             ],
@@ -78,31 +80,20 @@ async def generate_queries(context_image_b64: str, page_image_b64: str) -> Techn
         print(f"Error generating queries: {str(e)}")
         raise
 
-async def get_total_pages_info(pdf_folder: str) -> list:
-    """Collecte les informations sur toutes les pages disponibles dans tous les PDFs"""
-    pages_info = []
-    pdf_files = [f for f in os.listdir(pdf_folder) if f.lower().endswith('.pdf')]
-    
-    for pdf_file in pdf_files:
-        pdf_path = os.path.join(pdf_folder, pdf_file)
-        try:
-            pdf_document = fitz.open(pdf_path)
-            for page_num in range(len(pdf_document)):
-                pages_info.append({
-                    'pdf_file': pdf_file,
-                    'pdf_path': pdf_path,
-                    'page_num': page_num
-                })
-            pdf_document.close()
-        except Exception as e:
-            print(f"Error reading {pdf_file}: {str(e)}")
-    
-    return pages_info
+QUERY_LANGUAGES = ['reference', 'en', 'es', 'de', 'it']
+
+def get_valid_languages(result: dict) -> list:
+    """Langues pour lesquelles la page a produit une requête exploitable (pertinente et non NaN)."""
+    if not result or not result['queries'].get('relevant'):
+        return []
+    return [
+        lang for lang in QUERY_LANGUAGES
+        if (result['queries'].get(lang) or '').strip() not in ('', 'NaN', '"NaN"')
+    ]
 
 async def process_pdf_page(page_info: dict, context_image_b64: str, output_path: str):
     try:
-        page_image = capture_page_image_hd(page_info['pdf_path'], page_info['page_num'])
-        page_image_b64 = base64.b64encode(page_image).decode('utf-8')
+        page_image_b64 = await run_blocking(render_page_b64, page_info['pdf_path'], page_info['page_num'])
         
         queries = await generate_queries(context_image_b64, page_image_b64)
         result = {
@@ -123,15 +114,108 @@ async def process_pdf_page(page_info: dict, context_image_b64: str, output_path:
         async with aiofiles.open(output_path, 'a', encoding='utf-8') as f:
             await f.write(json.dumps(result, ensure_ascii=False) + '\n')
             print(f"Processed and saved page {page_info['page_num']} of {page_info['pdf_file']}")
+        return result
             
     except Exception as e:
         # Simplement logger l'erreur sans l'écrire dans le fichier
         print(f"Error processing page {page_info['page_num']} of {page_info['pdf_file']}: {str(e)}")
+        return None
+
+async def process_until_target(
+    pdf_folder: str,
+    output_path: str,
+    target: int,
+    group_by: str = None,
+    max_in_flight: int = 10,
+    seed: int = None,
+    prioritize: bool = False,
+    temperature: float = 0.0
+) -> TargetTracker:
+    """
+    Tire des pages jusqu'à obtenir `target` requêtes valides, puis annule le travail en cours.
+
+    Args:
+        target: Nombre de requêtes valides visé (au total, ou par groupe si `group_by` est défini).
+        group_by: None, 'language' (target par langue) ou 'pdf' (target par PDF).
+        max_in_flight: Nombre maximal de pages en cours de traitement.
+        prioritize: Traite d'abord les pages au meilleur score de priorité (par fenêtres du flux aléatoire).
+        temperature: Température du tirage par priorité (0 = ordre strict).
+    """
+    page_counts = count_pdf_pages(pdf_folder)
+    if group_by == 'language':
+        tracker = TargetTracker(target, groups=QUERY_LANGUAGES, combine='max')
+    elif group_by == 'pdf':
+        tracker = TargetTracker(target, groups=[f for f, n in page_counts.items() if n > 0], combine='sum')
+    else:
+        tracker = TargetTracker(target)
+
+    page_stream = iter_random_pages(page_counts, seed=seed)
+    if prioritize:
+        page_stream = iter_prioritized_pages(pdf_folder, page_stream, temperature=temperature, seed=seed)
+    context_images = {}  # Image de contexte rendue une seule fois par PDF
+    in_flight = {}
+    exhausted = False
+
+    def next_page():
+        for pdf_file, page_num in page_stream:
+            if group_by == 'pdf' and not tracker.is_open(pdf_file):
+                continue  # Ce PDF a déjà atteint son objectif
+            return {'pdf_file': pdf_file, 'pdf_path': os.path.join(pdf_folder, pdf_file), 'page_num': page_num}
+        return None
+
+    while not tracker.done:
+        # Lance en avance le nombre de pages nécessaire d'après le taux de validité observé
+        for _ in range(tracker.pages_to_dispatch(len(in_flight), max_in_flight)):
+            page_info = next_page()
+            if page_info is None:
+                exhausted = True
+                break
+            pdf_file = page_info['pdf_file']
+            try:
+                if pdf_file not in context_images:
+                    context_images[pdf_file] = await run_blocking(render_page_b64, page_info['pdf_path'], 0)
+            except Exception as e:
+                print(f"Error processing PDF {pdf_file}: {str(e)}")
+                continue
+            task = asyncio.create_task(process_pdf_page(page_info, context_images[pdf_file], output_path))
+            in_flight[task] = page_info
+        if not in_flight:
+            if exhausted:
+                print("No more pages available before reaching the target")
+                break
+            continue
+
+        done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            page_info = in_flight.pop(task)
+            valid_languages = get_valid_languages(task.result())
+            if group_by == 'pdf':
+                tracker.record([page_info['pdf_file']] if valid_languages else [])
+            elif group_by == 'language':
+                tracker.record(valid_languages)
+            else:
+                tracker.record([None] if valid_languages else [])
+
+    # Objectif atteint : annule les pages encore en cours
+    for task in in_flight:
+        task.cancel()
+    await asyncio.gather(*in_flight, return_exceptions=True)
+    if in_flight:
+        print(f"Cancelled {len(in_flight)} in-flight pages")
+    print(tracker.summary())
+    return tracker
         
 async def main():
     PDF_FOLDER = "/Users/vuong/Desktop/geotechnie/dataset-benchmark-v2"
     OUTPUT_FILE = "/Users/vuong/Desktop/geotechnie/benchmark-query.jsonl"
     PAGES_TO_PROCESS = 1000
+    SAMPLING_SEED = None
+    TARGET_VALID_QUERIES = None  # ex: 1000 pour s'arrêter dès 1000 requêtes valides
+    TARGET_GROUP_BY = None  # None, 'language' ou 'pdf'
+    MAX_IN_FLIGHT = 10
+    PRIORITIZE_PAGES = False  # Traite d'abord les pages les plus prometteuses
+    PRIORITY_TEMPERATURE = 0.0
+    PRIORITY_POOL_FACTOR = 3  # Taille du vivier de pages scorées, en multiple de PAGES_TO_PROCESS
     
     os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
     
@@ -139,14 +223,37 @@ async def main():
     async with aiofiles.open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
         await f.write('')
     
-    # Collecter toutes les pages disponibles
-    all_pages = await get_total_pages_info(PDF_FOLDER)
+    if TARGET_VALID_QUERIES is not None:
+        await process_until_target(
+            PDF_FOLDER,
+            OUTPUT_FILE,
+            TARGET_VALID_QUERIES,
+            group_by=TARGET_GROUP_BY,
+            max_in_flight=MAX_IN_FLIGHT,
+            seed=SAMPLING_SEED,
+            prioritize=PRIORITIZE_PAGES,
+            temperature=PRIORITY_TEMPERATURE
+        )
+        return
     
-    if len(all_pages) < PAGES_TO_PROCESS:
-        print(f"Warning: Only {len(all_pages)} pages available, processing all of them")
-        selected_pages = all_pages
+    # Tirer les pages à partir du seul nombre de pages de chaque PDF
+    page_counts = count_pdf_pages(PDF_FOLDER)
+    total_pages = sum(page_counts.values())
+    if total_pages < PAGES_TO_PROCESS:
+        print(f"Warning: Only {total_pages} pages available, processing all of them")
+    if PRIORITIZE_PAGES: # Garde les meilleures pages d'un vivier plus large
+        pool = sample_pages(page_counts, PAGES_TO_PROCESS * PRIORITY_POOL_FACTOR, seed=SAMPLING_SEED)
+        sampled_pages = prioritize_pages(score_pages(PDF_FOLDER, pool), PRIORITY_TEMPERATURE, SAMPLING_SEED)[:PAGES_TO_PROCESS]
     else:
-        selected_pages = random.sample(all_pages, PAGES_TO_PROCESS)
+        sampled_pages = sample_pages(page_counts, PAGES_TO_PROCESS, seed=SAMPLING_SEED)
+    selected_pages = [
+        {
+            'pdf_file': pdf_file,
+            'pdf_path': os.path.join(PDF_FOLDER, pdf_file),
+            'page_num': page_num
+        }
+        for pdf_file, page_num in sampled_pages
+    ]
     
     # Grouper les pages par PDF pour optimiser la lecture du contexte
     pages_by_pdf = {}
@@ -159,8 +266,7 @@ async def main():
     for pdf_file, pages in pages_by_pdf.items():
         try:
             # Capturer l'image de contexte une seule fois par PDF
-            context_image = capture_page_image_hd(pages[0]['pdf_path'], 0)
-            context_image_b64 = base64.b64encode(context_image).decode('utf-8')
+            context_image_b64 = await run_blocking(render_page_b64, pages[0]['pdf_path'], 0)
             
             # Traiter toutes les pages sélectionnées pour ce PDF
             for page_info in pages:
@@ -8,10 +8,20 @@ from PIL import Image
 import io
 import asyncio
 import json
+import hashlib
+import aiofiles
 from pydantic import BaseModel, Field
-from config import GEMINI_API_KEY
-from utils import process_with_retry
+from tqdm import tqdm
+from config import (
+    GEMINI_API_KEY, RANKING_MAX_CONCURRENT_QUERIES, RANKING_REQUESTS_PER_SECOND,
+    RERANK_STRATEGY, RERANK_WINDOW_SIZE, RERANK_WINDOW_STRIDE, RERANK_WINDOW_MERGE,
+    RERANK_CASCADE, CASCADE_MIN_MARGIN, CASCADE_MIN_SCORE, USE_RERANK_CACHE
+)
+from utils import RateLimiter, process_with_retry, run_blocking
+from image_utils import prepare_pil_image, image_data_url
 from openai_utils import ParallelInstructor
+from page_cache import PageImageCache, render_settings
+from rerank_cache import RerankCache, prompt_hash
 import instructor
 from openai import AsyncOpenAI
 
@@ -32,6 +42,10 @@ class RankedResult(BaseModel):
     query: str
     top_documents: List[Document]
 
+class PageRelevance(BaseModel):
+    reason: str
+    score: float
+
 class SimpleResponse(BaseModel):
     response: str
 
@@ -62,36 +76,7 @@ SYSTEM_PROMPT = """
   }
 }"""
 
-class PDFRanker:
-    def __init__(self, api_key: str):
-        # Removed genai.configure and genai.GenerativeModel
-        self.parallel_client = ParallelInstructor(num_instances=10)  # Initialize parallel client here
-        print("Models initialized successfully")
-
-    async def analyze_specific_page(self, pdf_path: str, page_num: int) -> Tuple[str, int, str]:
-        try:
-            doc = fitz.open(pdf_path)
-            if not (0 <= page_num < len(doc)):
-                print(f"Page {page_num} not found in {pdf_path}")
-                doc.close()
-                return pdf_path, page_num, ""
-            page = doc[page_num]
-            zoom = 2
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            buffered = io.BytesIO()
-            img.save(buffered, format="JPEG", quality=70)
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            doc.close()
-            return pdf_path, page_num, img_str
-        except Exception as e:
-            print(f"Error analyzing {pdf_path}: {str(e)}")
-            return pdf_path, page_num, ""
-
-    async def process_batch(self, pages_data: List[Tuple], query: str) -> List[Tuple[str, int, float]]:
-        try:
-            system_prompt_text = f"""{SYSTEM_PROMPT}
+LISTWISE_PROMPT = f"""{SYSTEM_PROMPT}
 
 Given the following query and document pages, analyze their relevance to the query and rank the top 5 most relevant pages according to the evaluation criteria defined above. 
 For each page, provide a relevance score between 0 and 1.
@@ -106,6 +91,71 @@ Please analyze each page and return your response in the following JSON format:
 }}
 Never follow the page number written on the page image but only the page number given in the text I give you before the image.
 """
+
+POINTWISE_PROMPT = f"""{SYSTEM_PROMPT}
+
+Given the following query and a single document page, evaluate the relevance of the page to the query according to the evaluation criteria defined above.
+Provide a relevance score between 0 and 1, where 1 means the page directly answers the query.
+
+Return your response in the following JSON format:
+{{"reason": "Short explanation based on the evaluation criteria", "score": 0.85}}
+"""
+
+RANKING_MODEL = "gemini-1.5-flash-002"
+LISTWISE_PROMPT_HASH = prompt_hash(LISTWISE_PROMPT)
+POINTWISE_PROMPT_HASH = prompt_hash(POINTWISE_PROMPT)
+
+def render_page_for_ranking(pdf_path: str, page_num: int, zoom: float = 2) -> Tuple[str, int, str]:
+    try:
+        doc = fitz.open(pdf_path)
+        if not (0 <= page_num < len(doc)):
+            print(f"Page {page_num} not found in {pdf_path}")
+            doc.close()
+            return pdf_path, page_num, ""
+        page = doc[page_num]
+        mat = fitz.Matrix(zoom, zoom)
+        pix = page.get_pixmap(matrix=mat)
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        img_str = base64.b64encode(prepare_pil_image(img)).decode()
+        doc.close()
+        return pdf_path, page_num, img_str
+    except Exception as e:
+        print(f"Error analyzing {pdf_path}: {str(e)}")
+        return pdf_path, page_num, ""
+
+class PDFRanker:
+    def __init__(
+        self,
+        api_key: str,
+        num_instances: int = RANKING_MAX_CONCURRENT_QUERIES,
+        page_cache: Optional[PageImageCache] = None,
+        rerank_cache: Optional[RerankCache] = None
+    ):
+        # Removed genai.configure and genai.GenerativeModel
+        self.parallel_client = ParallelInstructor(num_instances=num_instances)  # Un client par requête en vol
+        self.page_cache = page_cache if page_cache is not None else PageImageCache()
+        if rerank_cache is None and USE_RERANK_CACHE:
+            rerank_cache = RerankCache()
+        self.rerank_cache = rerank_cache
+        print("Models initialized successfully")
+
+    async def analyze_specific_page(self, pdf_path: str, page_num: int, zoom: float = 2) -> Tuple[str, int, str]:
+        # Les mêmes pages reviennent dans les candidats de nombreuses requêtes : rendu une seule fois
+        try:
+            key = self.page_cache.key(pdf_path, page_num, render_settings(zoom))
+        except OSError as e:
+            print(f"Error analyzing {pdf_path}: {str(e)}")
+            return pdf_path, page_num, ""
+
+        async def render() -> str:
+            # Rendu et encodage dans l'executor pour ne pas bloquer la boucle d'événements
+            return (await run_blocking(render_page_for_ranking, pdf_path, page_num, zoom))[2]
+
+        return pdf_path, page_num, await self.page_cache.get_or_render(key, render)
+
+    async def process_batch(self, pages_data: List[Tuple], query: str) -> List[Tuple[str, int, float]]:
+        try:
+            system_prompt_text = LISTWISE_PROMPT
             # Structure messages properly for multimodal input
             messages = [
                 {
@@ -130,7 +180,7 @@ Never follow the page number written on the page image but only the page number
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{img_str}"
+                            "url": image_data_url(img_str)
                         }
                     }
                 ])
@@ -138,7 +188,7 @@ Never follow the page number written on the page image but only the page number
             print("Calling Gemini API...")
             client = await self.parallel_client.get_client()
             response = await client.chat.completions.create(
-                model="gemini-1.5-flash-002",
+                model=RANKING_MODEL,
                 messages=messages,
                 response_model=Rankings,  # Using response_model for structured output
             )
@@ -164,6 +214,181 @@ Never follow the page number written on the page image but only the page number
             print(f"Batch processing error: {str(e)}")
             return []
 
+    async def score_page(self, page_data: Tuple[str, int, str], query: str) -> Optional[float]:
+        """Score de pertinence (0-1) d'une seule page pour la requête, None en cas d'échec."""
+        pdf_path, page_num, img_str = page_data
+        try:
+            client = await self.parallel_client.get_client()
+            response = await client.chat.completions.create(
+                model=RANKING_MODEL,
+                messages=[
+                    {"role": "system", "content": POINTWISE_PROMPT},
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": f"Query: {query}\n\nPage {page_num} of {os.path.basename(pdf_path)}:"},
+                            {"type": "image_url", "image_url": {"url": image_data_url(img_str)}}
+                        ]
+                    }
+                ],
+                response_model=PageRelevance,
+            )
+            return min(1.0, max(0.0, float(response.score)))
+        except Exception as e:
+            print(f"Pointwise scoring error for {os.path.basename(pdf_path)} page {page_num}: {str(e)}")
+            return None
+
+    async def _limited(self, call, rate_limiter: Optional[RateLimiter] = None):
+        """Attend l'appel LLM `call` sous le rate limit partagé, s'il y en a un."""
+        if rate_limiter is None:
+            return await call
+        async with rate_limiter:
+            result = await call
+        await rate_limiter.record_success()
+        return result
+
+    async def _rank_window(
+        self,
+        pages_data: List[Tuple],
+        query: str,
+        rate_limiter: Optional[RateLimiter] = None
+    ) -> List[Tuple[str, int, float]]:
+        """
+        Un appel de classement listwise sur `pages_data`. La réponse est mise en cache par fenêtre :
+        les fenêtres communes à deux listes de candidats qui se recouvrent ne sont classées qu'une fois.
+        """
+        key = None
+        if self.rerank_cache is not None:
+            try:
+                key = await self.rerank_cache.key(
+                    query, [(pdf_path, page_num) for pdf_path, page_num, _ in pages_data],
+                    RANKING_MODEL, LISTWISE_PROMPT_HASH
+                )
+            except OSError as e:
+                print(f"Rerank cache disabled for this batch: {str(e)}")
+            cached = self.rerank_cache.get(key) if key is not None else None
+            if cached is not None:
+                return [(pages_data[position][0], pages_data[position][1], score) for position, score in cached]
+        results = await self._limited(self.process_batch(pages_data, query), rate_limiter)
+        if key is not None and results:  # Une réponse vide (échec) n'est pas mise en cache
+            positions = {(pdf_path, page_num): i for i, (pdf_path, page_num, _) in enumerate(pages_data)}
+            self.rerank_cache.put(key, [(positions[(pdf_path, page_num)], score) for pdf_path, page_num, score in results])
+        return results
+
+    async def rank_pointwise(
+        self,
+        pages_data: List[Tuple],
+        query: str,
+        rate_limiter: Optional[RateLimiter] = None
+    ) -> List[Tuple[str, int, float]]:
+        """
+        Un appel par page, tous lancés en parallèle sous le rate limit partagé : les scores ne
+        dépendent pas des autres candidats et sont mis en cache par paire (requête, page).
+        Les pages en échec sont omises.
+        """
+        async def score(page_data: Tuple[str, int, str]) -> Optional[float]:
+            pdf_path, page_num, _ = page_data
+            key = None
+            if self.rerank_cache is not None:
+                try:
+                    key = await self.rerank_cache.key(query, [(pdf_path, page_num)], RANKING_MODEL, POINTWISE_PROMPT_HASH)
+                except OSError as e:
+                    print(f"Rerank cache disabled for this page: {str(e)}")
+                cached = self.rerank_cache.get(key) if key is not None else None
+                if cached:
+                    return cached[0][1]
+            value = await self._limited(self.score_page(page_data, query), rate_limiter)
+            if key is not None and value is not None:
+                self.rerank_cache.put(key, [(0, value)])
+            return value
+
+        scores = await asyncio.gather(*[score(page_data) for page_data in pages_data])
+        return [
+            (pdf_path, page_num, value)
+            for (pdf_path, page_num, _), value in zip(pages_data, scores) if value is not None
+        ]
+
+    async def rank_windowed(
+        self,
+        pages_data: List[Tuple],
+        query: str,
+        window: int = RERANK_WINDOW_SIZE,
+        stride: int = RERANK_WINDOW_STRIDE,
+        merge: str = RERANK_WINDOW_MERGE,
+        rate_limiter: Optional[RateLimiter] = None
+    ) -> List[Tuple[str, int, float]]:
+        """
+        Classement par fenêtres glissantes de `window` pages (décalées de `stride`), envoyées en parallèle.
+        `merge="score"` : score moyen de chaque page sur les fenêtres abouties qui la contiennent
+        (0 quand elle n'y est pas retenue). `merge="tournament"` : la meilleure moitié de chaque
+        fenêtre passe au tour suivant, jusqu'à tenir dans une seule fenêtre classée en dernier appel.
+        """
+        if not 0 < stride <= window:
+            # Un décalage plus grand que la fenêtre laisserait des pages jamais classées
+            raise ValueError(f"Window stride must be between 1 and the window size ({window}), got {stride}")
+        if len(pages_data) <= window:
+            return await self._rank_window(pages_data, query, rate_limiter)
+        if merge == "tournament":
+            candidates = list(pages_data)
+            while len(candidates) > window:
+                windows = [candidates[start:start + window] for start in range(0, len(candidates), window)]
+                rankings = await asyncio.gather(*[self._rank_window(w, query, rate_limiter) for w in windows])
+                advance = max(1, window // 2)
+                winners = []
+                for pages, ranking in zip(windows, rankings):
+                    if not ranking:  # Fenêtre en échec : ses pages passent sans être départagées
+                        winners.extend(pages[:advance])
+                        continue
+                    best = sorted(ranking, key=lambda result: result[2], reverse=True)[:advance]
+                    ranked_pages = {(pdf_path, page_num) for pdf_path, page_num, _ in best}
+                    winners.extend(page for page in pages if (page[0], page[1]) in ranked_pages)
+                if len(winners) >= len(candidates):
+                    break
+                candidates = winners
+            # Tours sans progrès (fenêtres en échec) : le dernier appel reste limité à `window` pages,
+            # les autres suivent dans l'ordre des embeddings, derrière les pages classées
+            final, rest = candidates[:window], candidates[window:]
+            results = await self._rank_window(final, query, rate_limiter)
+            if results and rest:
+                print(f"Tournament stalled: {len(rest)} pages kept in embedding order after the final window")
+                results = results + [(pdf_path, page_num, 0.0) for pdf_path, page_num, _ in rest]
+            return results
+        if merge != "score":
+            raise ValueError(f"Unknown window merge: {merge}")
+        starts = list(range(0, len(pages_data) - window + 1, stride))
+        if starts[-1] + window < len(pages_data):
+            starts.append(len(pages_data) - window)  # Dernière fenêtre alignée sur la fin
+        windows = [pages_data[start:start + window] for start in starts]
+        rankings = await asyncio.gather(*[self._rank_window(w, query, rate_limiter) for w in windows])
+        totals, counts = {}, {}
+        for pages, ranking in zip(windows, rankings):
+            if not ranking:
+                continue
+            scores = {(pdf_path, page_num): score for pdf_path, page_num, score in ranking}
+            for pdf_path, page_num, _ in pages:
+                key = (pdf_path, page_num)
+                totals[key] = totals.get(key, 0.0) + scores.get(key, 0.0)
+                counts[key] = counts.get(key, 0) + 1
+        return [(pdf_path, page_num, totals[(pdf_path, page_num)] / counts[(pdf_path, page_num)]) for pdf_path, page_num in totals]
+
+    async def rerank(
+        self,
+        pages_data: List[Tuple],
+        query: str,
+        rate_limiter: Optional[RateLimiter] = None,
+        strategy: str = RERANK_STRATEGY
+    ) -> RankedResult:
+        """Classe les pages candidates d'une requête selon la stratégie configurée."""
+        if strategy == "listwise":
+            results = await self._rank_window(pages_data, query, rate_limiter)
+        elif strategy == "windowed":
+            results = await self.rank_windowed(pages_data, query, rate_limiter=rate_limiter)
+        elif strategy == "pointwise":
+            results = await self.rank_pointwise(pages_data, query, rate_limiter)
+        else:
+            raise ValueError(f"Unknown rerank strategy: {strategy}")
+        return await self.analyze_and_rank_documents(query, results)
+
     async def analyze_and_rank_documents(self, query: str, results: List[Tuple[str, int, float]]) -> RankedResult:
         try:
             sorted_results = sorted(results, key=lambda x: x[2], reverse=True)
@@ -182,4 +407,224 @@ Never follow the page number written on the page image but only the page number
             )
         except Exception as e:
             print(f"Error during ranking: {str(e)}")
-            return RankedResult(query=query, top_documents=[])
\ No newline at end of file
+            return RankedResult(query=query, top_documents=[])
+
+
+def valid_matches(query_result: Dict) -> List[Dict]:
+    """top_15_matches avec un nom de PDF et un numéro de page."""
+    return [
+        match for match in query_result.get('top_15_matches', [])
+        if match.get('pdf_name') and match['pdf_name'].strip() and match.get('page_number') is not None
+    ]
+
+
+def candidate_pages(query_result: Dict, pdf_folder: str) -> List[Tuple[str, int]]:
+    """(pdf_path, page) des top_15_matches dont le PDF existe."""
+    pages = []
+    for match in valid_matches(query_result):
+        pdf_path = os.path.join(pdf_folder, match['pdf_name'])
+        if os.path.exists(pdf_path):
+            pages.append((pdf_path, match['page_number']))
+    return pages
+
+
+def is_confident(query_result: Dict, min_margin: float = CASCADE_MIN_MARGIN, min_score: float = CASCADE_MIN_SCORE) -> bool:
+    """Vrai si le top 1 des embeddings est assez haut et assez loin du 2e pour se passer du LLM."""
+    scores = sorted((match.get('similarity_score', 0.0) for match in valid_matches(query_result)), reverse=True)
+    if not scores or scores[0] < min_score:
+        return False
+    return len(scores) == 1 or scores[0] - scores[1] >= min_margin
+
+
+def embedding_ranking(query_result: Dict, top_k: int = 5) -> Dict:
+    """Résultat au format du reranking, directement à partir de l'ordre des embeddings."""
+    matches = sorted(valid_matches(query_result), key=lambda match: match.get('similarity_score', 0.0), reverse=True)
+    return {
+        "query": query_result.get('query', ''),
+        "ranked_documents": [
+            {"rank": i, "file_name": os.path.basename(match['pdf_name']), "page": match['page_number']}
+            for i, match in enumerate(matches[:top_k], 1)
+        ]
+    }
+
+
+async def rank_query(
+    ranker: PDFRanker,
+    query_result: Dict,
+    pdf_folder: str,
+    rate_limiter: RateLimiter
+) -> Optional[Dict]:
+    """Reranke une requête : rendu des pages candidates en parallèle puis un appel LLM. None si rien à classer."""
+    query = query_result.get('query', '')
+    pages = candidate_pages(query_result, pdf_folder)
+    if not pages:
+        print(f"No valid PDFs found for query: {query[:80]}")
+        return None
+    rendered = await asyncio.gather(
+        *[ranker.analyze_specific_page(pdf_path, page_num) for pdf_path, page_num in pages],
+        return_exceptions=True
+    )
+    pages_data = []
+    for (pdf_path, _), data in zip(pages, rendered):
+        if isinstance(data, Exception):
+            print(f"Error processing {os.path.basename(pdf_path)}: {str(data)}")
+        elif data[2]:
+            pages_data.append(data)
+    if not pages_data:
+        print("No valid page data extracted")
+        return None
+    ranked_results = await ranker.rerank(pages_data, query, rate_limiter)
+    if not ranked_results.top_documents:
+        print("No results from Gemini processing")
+        return None
+    return {
+        "query": query,
+        "ranked_documents": [
+            {"rank": i, "file_name": doc.file_name, "page": doc.page_number}
+            for i, doc in enumerate(ranked_results.top_documents, 1)
+        ]
+    }
+
+
+async def rerank_queries(
+    ranker: PDFRanker,
+    query_results: List[Dict],
+    pdf_folder: str,
+    max_in_flight: int = RANKING_MAX_CONCURRENT_QUERIES,
+    rate_limiter: Optional[RateLimiter] = None,
+    on_result=None,
+    cascade: bool = RERANK_CASCADE
+) -> List[Dict]:
+    """
+    Reranke les requêtes avec au plus `max_in_flight` requêtes en cours et un rate limit partagé
+    pour tous les appels LLM. `on_result(index, result)` est appelé dès qu'une requête est classée ;
+    le résultat final suit l'ordre de `query_results` (requêtes sans classement omises).
+    Avec `cascade`, les requêtes dont le classement par embeddings est sûr (voir `is_confident`)
+    sont gardées telles quelles, sans appel LLM.
+    """
+    rate_limiter = rate_limiter or RateLimiter(requests_per_second=RANKING_REQUESTS_PER_SECOND)
+    semaphore = asyncio.Semaphore(max_in_flight)
+    results: Dict[int, Dict] = {}
+    to_rerank = list(enumerate(query_results))
+    if cascade:
+        to_rerank = []
+        for index, query_result in enumerate(query_results):
+            if is_confident(query_result):
+                results[index] = embedding_ranking(query_result)
+                if on_result is not None:
+                    on_result(index, results[index])
+            else:
+                to_rerank.append((index, query_result))
+        print(f"Cascade: {len(query_results) - len(to_rerank)}/{len(query_results)} queries kept from embeddings, "
+              f"{len(to_rerank)} sent to LLM reranking")
+
+    async def run(index: int, query_result: Dict):
+        async with semaphore:
+            try:
+                result = await rank_query(ranker, query_result, pdf_folder, rate_limiter)
+            except Exception as e:
+                print(f"Error processing query {index + 1}: {str(e)}")
+                result = None
+        if result is not None:
+            results[index] = result
+            if on_result is not None:
+                on_result(index, result)
+
+    tasks = [asyncio.create_task(run(index, query_result)) for index, query_result in to_rerank]
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Ranking Queries"):
+        await task
+    print(ranker.page_cache.summary())
+    if ranker.rerank_cache is not None:
+        print(ranker.rerank_cache.summary())
+    return [results[index] for index in sorted(results)]
+
+
+def ranking_key(query_result: Dict) -> str:
+    """
+    Clé d'un résultat classé : texte de la requête et liste ordonnée des pages candidates. Deux requêtes
+    identiques avec les mêmes candidats partagent leur classement ; un nouvel échantillon dont les
+    candidats diffèrent ne réutilise pas un classement périmé.
+    """
+    candidates = [[match.get('pdf_name'), match.get('page_number')] for match in query_result.get('top_15_matches', [])]
+    payload = json.dumps([query_result.get('query', ''), candidates], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_ranked_results(jsonl_path: str) -> Dict[str, Dict]:
+    """
+    Résultats déjà classés, par `ranking_key` (les lignes sans clé sont ignorées). Une dernière ligne
+    tronquée par un arrêt brutal est retirée du fichier pour que les ajouts suivants repartent sur une ligne propre.
+    """
+    ranked = {}
+    if not os.path.exists(jsonl_path):
+        return ranked
+    with open(jsonl_path, 'rb+') as f:
+        content = f.read()
+        if content and not content.endswith(b'\n'):
+            f.truncate(content.rfind(b'\n') + 1)
+    with open(jsonl_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "key" in record:
+                ranked[record["key"]] = record
+    return ranked
+
+
+class RankedResultWriter:
+    """
+    Ajoute les résultats au JSONL depuis une seule tâche d'écriture (aiofiles), alimentée par une file :
+    `write` ne bloque pas la boucle d'événements pendant que les autres requêtes sont classées.
+    """
+    def __init__(self, jsonl_path: str):
+        self.jsonl_path = jsonl_path
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task = None
+
+    async def __aenter__(self) -> 'RankedResultWriter':
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.queue.put_nowait(None)
+        await self._task
+
+    def write(self, record: Dict):
+        self.queue.put_nowait(record)
+
+    async def _run(self):
+        async with aiofiles.open(self.jsonl_path, 'a', encoding='utf-8') as f:
+            while True:
+                record = await self.queue.get()
+                if record is None:
+                    break
+                lines = [json.dumps(record, ensure_ascii=False) + '\n']
+                while not self.queue.empty():  # Regroupe les résultats arrivés entre deux écritures
+                    record = self.queue.get_nowait()
+                    if record is None:
+                        self.queue.put_nowait(None)
+                        break
+                    lines.append(json.dumps(record, ensure_ascii=False) + '\n')
+                await f.write(''.join(lines))
+                await f.flush()
+
+
+def compact_ranked_results(jsonl_path: str, json_path: str, query_results: Optional[List[Dict]] = None) -> int:
+    """
+    Réécrit le JSONL au format JSON historique (liste indentée). Avec `query_results`, un enregistrement
+    par résultat de retrieval, dans leur ordre : les requêtes en double restent des enregistrements distincts.
+    """
+    ranked = load_ranked_results(jsonl_path)
+    if query_results is not None:
+        keys = [ranking_key(query_result) for query_result in query_results]
+        records = [ranked[key] for key in keys if key in ranked]
+    else:
+        records = list(ranked.values())
+    records = [{k: v for k, v in record.items() if k != "key"} for record in records]
+    tmp_path = json_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(records, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, json_path)
+    return len(records)
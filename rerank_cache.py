@@ -0,0 +1,99 @@
+#rerank_cache.py
+import os
+import json
+import asyncio
+import hashlib
+from typing import Dict, List, Optional, Sequence, Tuple
+from config import RERANK_CACHE_FILE
+from embedding_store import file_hash
+from utils import run_blocking
+
+
+def normalize_query(query: str) -> str:
+    """Requête sans différences d'espaces ni de casse, pour que deux formulations identiques partagent le cache."""
+    return " ".join(query.split()).casefold()
+
+
+def prompt_hash(*parts: str) -> str:
+    return hashlib.sha256("\n".join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+class RerankCache:
+    """
+    Cache persistant des réponses de classement LLM, en JSONL append-only. La clé couvre la requête
+    normalisée, la liste ordonnée des pages candidates (contenu du PDF + numéro de page), le modèle
+    et le hash du prompt : modifier l'un d'eux invalide l'entrée. Les scores sont stockés par
+    position dans la liste des candidats, sans chemin, pour rester valables si le dossier bouge.
+    """
+    def __init__(self, path: str = RERANK_CACHE_FILE):
+        self.path = path
+        self._entries: Dict[str, List] = {}
+        self.stats = {"hits": 0, "misses": 0}
+        # (chemin, taille, mtime) -> hash du PDF, calculé une fois par fichier hors de la boucle d'événements
+        self._pdf_hashes: Dict[Tuple[str, int, float], asyncio.Future] = {}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        # Une dernière ligne tronquée par un arrêt brutal est retirée : sinon l'ajout suivant
+        # serait collé à sa suite et perdu au prochain chargement
+        with open(self.path, 'rb+') as f:
+            content = f.read()
+            if content and not content.endswith(b'\n'):
+                f.truncate(content.rfind(b'\n') + 1)
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self._entries[record["key"]] = record["scores"]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def pdf_hash(self, pdf_path: str) -> str:
+        """
+        Hash du contenu d'un PDF, lu dans l'executor partagé : hacher un gros corpus au premier passage
+        bloquerait sinon la boucle. Les appels concurrents sur un même fichier partagent le calcul.
+        """
+        stat = os.stat(pdf_path)
+        cache_key = (os.path.abspath(pdf_path), stat.st_size, stat.st_mtime)
+        if cache_key not in self._pdf_hashes:
+            self._pdf_hashes[cache_key] = asyncio.ensure_future(run_blocking(file_hash, pdf_path))
+        try:
+            return await asyncio.shield(self._pdf_hashes[cache_key])
+        except OSError:
+            self._pdf_hashes.pop(cache_key, None)  # Le fichier sera relu au prochain appel
+            raise
+
+    async def key(self, query: str, pages: Sequence[Tuple[str, int]], model: str, prompt: str) -> str:
+        hashes = await asyncio.gather(*(self.pdf_hash(pdf_path) for pdf_path, _ in pages))
+        candidates = [[digest, page_num] for digest, (_, page_num) in zip(hashes, pages)]
+        payload = json.dumps([normalize_query(query), candidates, model, prompt])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[List[Tuple[int, float]]]:
+        """(position du candidat, score) de la réponse en cache, ou None."""
+        scores = self._entries.get(key)
+        if scores is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return [(position, score) for position, score in scores]
+
+    def put(self, key: str, scores: List[Tuple[int, float]]):
+        if key in self._entries:
+            return
+        self._entries[key] = [[position, score] for position, score in scores]
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"key": key, "scores": self._entries[key]}) + '\n')
+            f.flush()
+
+    def summary(self) -> str:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups if lookups else 0.0
+        return (f"Rerank cache: {self.stats['hits']} hits, {self.stats['misses']} misses "
+                f"({hit_rate:.1%} hit rate), {len(self._entries)} entries")
@@ -0,0 +1,152 @@
+#retrieval.py
+import numpy as np
+from typing import Iterator, List, Optional, Tuple
+
+QUERY_CHUNK_SIZE = 1024  # Requêtes scorées par produit matriciel (mémoire : chunk x N scores)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Normalise chaque ligne en norme L2 (float32), les lignes nulles restent nulles."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def stack_embeddings(embeddings: List[Optional[np.ndarray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Empile les embeddings présents en une matrice normalisée ; retourne aussi leurs positions d'origine."""
+    valid_indices = np.array([i for i, embedding in enumerate(embeddings) if embedding is not None], dtype=np.int64)
+    if len(valid_indices) == 0:
+        return np.zeros((0, 0), dtype=np.float32), valid_indices
+    matrix = np.stack([np.asarray(embeddings[i], dtype=np.float32).reshape(-1) for i in valid_indices])
+    return normalize_rows(matrix), valid_indices
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Indices et scores des k meilleurs scores de chaque ligne, triés par score décroissant."""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64), np.zeros((scores.shape[0], 0), dtype=scores.dtype)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    # Tri par score décroissant puis indice décroissant, comme np.argsort(...)[::-1]
+    order = np.lexsort((-candidates, -candidate_scores), axis=1)
+    indices = np.take_along_axis(candidates, order, axis=1)
+    return indices, np.take_along_axis(scores, indices, axis=1)
+
+
+def gold_ranks(scores: np.ndarray, gold_columns: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rang (0 = premier) et score de la page attendue pour chaque ligne.
+    À score égal, l'indice le plus grand passe devant, comme avec np.argsort(...)[::-1].
+    """
+    rows = np.arange(scores.shape[0])
+    gold_scores = scores[rows, gold_columns]
+    above = (scores > gold_scores[:, None]).sum(axis=1)
+    columns = np.arange(scores.shape[1])
+    ties_after = ((scores == gold_scores[:, None]) & (columns[None, :] > gold_columns[:, None])).sum(axis=1)
+    return above + ties_after, gold_scores
+
+
+def ndcg_at_k(ranks: np.ndarray, k: int = 5) -> np.ndarray:
+    """NDCG@k avec une seule page pertinente : 1 / log2(rang + 2) si elle est dans le top k, sinon 0."""
+    ranks = np.asarray(ranks)
+    return np.where(ranks < k, 1.0 / np.log2(ranks + 2.0), 0.0)
+
+
+def recall_at_k(ranks: np.ndarray, k: int = 1) -> np.ndarray:
+    return (np.asarray(ranks) < k).astype(np.float64)
+
+
+def score_queries(
+    query_matrix: np.ndarray,
+    corpus_matrix: np.ndarray,
+    gold_columns: np.ndarray,
+    k: int = 15,
+    chunk_size: int = QUERY_CHUNK_SIZE
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Score toutes les requêtes (lignes normalisées) contre le corpus par produits matriciels
+    de `chunk_size` requêtes. Retourne (top_indices, top_scores, rangs, scores de la page attendue).
+    """
+    n_queries = query_matrix.shape[0]
+    top_indices = np.zeros((n_queries, min(k, corpus_matrix.shape[0])), dtype=np.int64)
+    top_scores = np.zeros(top_indices.shape, dtype=np.float32)
+    ranks = np.zeros(n_queries, dtype=np.int64)
+    scores_of_gold = np.zeros(n_queries, dtype=np.float32)
+    for start in range(0, n_queries, chunk_size):
+        end = min(start + chunk_size, n_queries)
+        scores = query_matrix[start:end] @ corpus_matrix.T
+        top_indices[start:end], top_scores[start:end] = top_k(scores, k)
+        ranks[start:end], scores_of_gold[start:end] = gold_ranks(scores, gold_columns[start:end])
+    return top_indices, top_scores, ranks, scores_of_gold
+
+
+class StreamingTopK:
+    """
+    Top-k par requête sur un corpus parcouru par blocs de lignes, sans matrice Q x N complète.
+    Si le score de la page attendue est connu (`gold_scores`), son rang est compté au fil des blocs ;
+    la mémoire reste bornée par la taille d'un bloc.
+    """
+    def __init__(
+        self,
+        query_matrix: np.ndarray,
+        k: int = 15,
+        gold_columns: Optional[np.ndarray] = None,
+        gold_scores: Optional[np.ndarray] = None
+    ):
+        self.query_matrix = query_matrix
+        self.k = k
+        n_queries = query_matrix.shape[0]
+        self.indices = np.zeros((n_queries, 0), dtype=np.int64)
+        self.scores = np.zeros((n_queries, 0), dtype=np.float32)
+        self.gold_columns = gold_columns
+        self.gold_scores = gold_scores
+        self.ranks = np.zeros(n_queries, dtype=np.int64)
+        self.rows_seen = 0
+
+    def update(self, block: np.ndarray, columns: Optional[np.ndarray] = None):
+        """
+        Ajoute un bloc de lignes normalisées du corpus. `columns` donne l'indice global de chaque
+        ligne (par défaut, les lignes suivent celles déjà vues).
+        """
+        if columns is None:
+            columns = np.arange(self.rows_seen, self.rows_seen + block.shape[0])
+        scores = self.query_matrix @ block.T
+        block_positions, block_scores = top_k(scores, self.k)
+        candidates = np.concatenate([self.indices, columns[block_positions]], axis=1)
+        candidate_scores = np.concatenate([self.scores, block_scores], axis=1)
+        self.indices, self.scores = top_k_candidates(candidate_scores, candidates, self.k)
+        if self.gold_scores is not None:
+            row_columns = columns[None, :]
+            gold_columns = self.gold_columns[:, None]
+            gold_scores = self.gold_scores[:, None]
+            # La page attendue elle-même est exclue : son score recalculé peut différer au dernier bit
+            above = (scores > gold_scores) & (row_columns != gold_columns)
+            ties_after = (scores == gold_scores) & (row_columns > gold_columns)
+            self.ranks += (above | ties_after).sum(axis=1)
+        if len(columns):
+            self.rows_seen = max(self.rows_seen, int(columns.max()) + 1)
+
+    def result(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(top_indices globaux, top_scores, rangs de la page attendue)."""
+        return self.indices, self.scores, self.ranks
+
+
+def top_k_candidates(candidate_scores: np.ndarray, candidates: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Fusionne des listes de candidats (indices globaux) et garde les k meilleurs de chaque ligne."""
+    positions, scores = top_k(candidate_scores, k)
+    indices = np.take_along_axis(candidates, positions, axis=1)
+    # Rétablit l'ordre par indice global décroissant à score égal
+    order = np.lexsort((-indices, -scores), axis=1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def iter_matrix_blocks(matrix: np.ndarray, block_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Parcourt une matrice (par ex. la memmap du store) par blocs normalisés de `block_size` lignes."""
+    for start in range(0, matrix.shape[0], block_size):
+        end = min(start + block_size, matrix.shape[0])
+        yield normalize_rows(matrix[start:end]), np.arange(start, end)
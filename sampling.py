@@ -0,0 +1,169 @@
+#sampling.py
+import os
+import json
+import heapq
+import random
+import fitz
+from typing import Dict, List, Tuple, Optional, Iterable, Iterator
+
+NUM_LANGUAGE_SLOTS = 5  # Les langues sont attribuées cycliquement selon le numéro de page
+
+
+def count_pdf_pages(folder_path: str) -> Dict[str, int]:
+    """Lit uniquement le nombre de pages de chaque PDF du dossier, sans rendu."""
+    page_counts = {}
+    pdf_files = sorted(f for f in os.listdir(folder_path) if f.lower().endswith('.pdf'))
+    for pdf_file in pdf_files:
+        try:
+            with fitz.open(os.path.join(folder_path, pdf_file)) as pdf_document:
+                page_counts[pdf_file] = pdf_document.page_count
+        except Exception as e:
+            print(f"Error reading {pdf_file}: {str(e)}")
+    return page_counts
+
+
+def iter_pages(page_counts: Dict[str, int]) -> Iterator[Tuple[str, int]]:
+    for pdf_file, total_pages in page_counts.items():
+        for page_num in range(total_pages):
+            yield pdf_file, page_num
+
+
+def language_slot(page_num: int, num_slots: int = NUM_LANGUAGE_SLOTS) -> int:
+    return page_num % num_slots
+
+
+def _stratum_sizes(page_counts: Dict[str, int], stratify_by: Optional[str]) -> Dict:
+    # Taille de chaque strate calculée à partir des seuls nombres de pages
+    if stratify_by is None:
+        return {None: sum(page_counts.values())}
+    if stratify_by == 'pdf':
+        return {pdf_file: n for pdf_file, n in page_counts.items() if n > 0}
+    if stratify_by == 'language':
+        sizes = {slot: 0 for slot in range(NUM_LANGUAGE_SLOTS)}
+        for n in page_counts.values():
+            for slot in range(NUM_LANGUAGE_SLOTS):
+                if n > slot:
+                    sizes[slot] += (n - slot + NUM_LANGUAGE_SLOTS - 1) // NUM_LANGUAGE_SLOTS
+        return sizes
+    raise ValueError(f"Unsupported stratification: {stratify_by}")
+
+
+def _allocate_quotas(sizes: Dict, num_pages: int) -> Dict:
+    # Répartition proportionnelle par la méthode du plus fort reste
+    total = sum(sizes.values())
+    if total == 0:
+        return {key: 0 for key in sizes}
+    num_pages = min(num_pages, total)
+    exact = {key: num_pages * size / total for key, size in sizes.items()}
+    quotas = {key: int(value) for key, value in exact.items()}
+    remainders = sorted(sizes, key=lambda key: (exact[key] - quotas[key], sizes[key]), reverse=True)
+    for key in remainders[:num_pages - sum(quotas.values())]:
+        quotas[key] += 1
+    return quotas
+
+
+def sample_pages(
+    page_counts: Dict[str, int],
+    num_pages: int,
+    seed: Optional[int] = None,
+    stratify_by: Optional[str] = None,
+    pdf_weights: Optional[Dict[str, float]] = None
+) -> List[Tuple[str, int]]:
+    """
+    Sélectionne `num_pages` pages (pdf_file, page_num) en une passe à partir des nombres de pages.
+
+    Args:
+        page_counts: Nombre de pages par PDF (voir `count_pdf_pages`).
+        num_pages: Nombre total de pages à sélectionner.
+        seed: Graine du générateur aléatoire, pour un tirage reproductible.
+        stratify_by: None, 'pdf' ou 'language' (créneau de langue = page_num % 5).
+            Chaque strate reçoit un quota proportionnel à sa taille.
+        pdf_weights: Poids optionnel appliqué à chaque page d'un PDF (tirage pondéré).
+    """
+    rng = random.Random(seed)
+    quotas = _allocate_quotas(_stratum_sizes(page_counts, stratify_by), num_pages)
+
+    def stratum_of(pdf_file: str, page_num: int):
+        if stratify_by == 'pdf':
+            return pdf_file
+        if stratify_by == 'language':
+            return language_slot(page_num)
+        return None
+
+    # Un réservoir par strate, alimenté par un unique parcours des pages :
+    # algorithme R pour le tirage uniforme, A-Res (clé u^(1/w)) pour le tirage pondéré
+    reservoirs = {key: [] for key in quotas}
+    seen = {key: 0 for key in quotas}
+    for pdf_file, page_num in iter_pages(page_counts):
+        key = stratum_of(pdf_file, page_num)
+        k = quotas.get(key, 0)
+        if k == 0:
+            continue
+        item = (pdf_file, page_num)
+        if pdf_weights is not None:
+            weight = pdf_weights.get(pdf_file, 0.0)
+            if weight <= 0:
+                continue
+            entry = (rng.random() ** (1.0 / weight), seen[key], item)
+            if len(reservoirs[key]) < k:
+                heapq.heappush(reservoirs[key], entry)
+            elif entry[0] > reservoirs[key][0][0]:
+                heapq.heapreplace(reservoirs[key], entry)
+        else:
+            if seen[key] < k:
+                reservoirs[key].append(item)
+            else:
+                j = rng.randint(0, seen[key])
+                if j < k:
+                    reservoirs[key][j] = item
+        seen[key] += 1
+
+    selected = []
+    for key, reservoir in reservoirs.items():
+        if pdf_weights is not None:
+            selected.extend(item for _, _, item in reservoir)
+        else:
+            selected.extend(reservoir)
+    return selected
+
+
+def iter_random_pages(page_counts: Dict[str, int], seed: Optional[int] = None) -> Iterator[Tuple[str, int]]:
+    """
+    Parcourt toutes les pages dans un ordre aléatoire, sans remise et sans matérialiser la liste :
+    le PDF est tiré proportionnellement à ses pages restantes, puis la page par Fisher-Yates paresseux.
+    """
+    rng = random.Random(seed)
+    remaining = {pdf_file: n for pdf_file, n in page_counts.items() if n > 0}
+    swaps = {pdf_file: {} for pdf_file in remaining}  # Permutations partielles par PDF
+    total = sum(remaining.values())
+    pdf_files = list(remaining)
+    while total > 0:
+        target = rng.randrange(total)
+        for pdf_file in pdf_files:
+            if target < remaining[pdf_file]:
+                break
+            target -= remaining[pdf_file]
+        n = remaining[pdf_file]
+        j = rng.randrange(n)
+        swapped = swaps[pdf_file]
+        page_num = swapped.get(j, j)
+        swapped[j] = swapped.pop(n - 1, n - 1)
+        remaining[pdf_file] = n - 1
+        total -= 1
+        if remaining[pdf_file] == 0:
+            pdf_files.remove(pdf_file)
+        yield pdf_file, page_num
+
+
+def group_pages_by_pdf(pages: Iterable[Tuple[str, int]]) -> Dict[str, List[int]]:
+    random_pages = {}
+    for pdf_file, page_num in pages:
+        random_pages.setdefault(pdf_file, []).append(page_num)
+    for pdf_file in random_pages:
+        random_pages[pdf_file] = sorted(random_pages[pdf_file])
+    return random_pages
+
+
+def write_random_pages_json(random_pages: Dict[str, List[int]], output_file: str):
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(random_pages, f, indent=2)
@@ -0,0 +1,98 @@
+#scheduling.py
+import os
+import math
+import random
+import fitz
+from typing import Dict, List, Tuple, Optional, Iterable, Iterator
+
+# Poids des indices de priorité, calculés par PyMuPDF sans rendu
+PRIORITY_WEIGHTS = {
+    'text_density': 0.5,   # Quantité de texte (pages blanches ou quasi vides pénalisées)
+    'figures': 0.3,        # Présence d'images
+    'tables': 0.2          # Présence de tracés vectoriels (tableaux, graphiques, schémas)
+}
+FULL_TEXT_CHARS = 1500  # Nombre de caractères au-delà duquel la densité de texte est maximale
+MIN_TEXT_CHARS = 100    # En dessous, la page est considérée comme quasi vide
+TABLE_DRAWINGS = 20     # Nombre de tracés vectoriels signalant un tableau ou un graphique
+EDGE_FRACTION = 0.05    # Part des pages en début/fin de document (sommaire, annexes...)
+EDGE_PENALTY = 0.3
+
+
+def page_priority_score(page: fitz.Page, page_num: int, total_pages: int) -> float:
+    """Score entre 0 et 1 estimant la probabilité qu'une page produise des requêtes valides."""
+    if page_num == 0:
+        return 0.0  # Page de garde, déjà utilisée comme contexte
+    text_chars = len(page.get_text("text").strip())
+    text_density = 0.0 if text_chars < MIN_TEXT_CHARS else min(1.0, text_chars / FULL_TEXT_CHARS)
+    has_figures = 1.0 if page.get_images(full=False) else 0.0
+    has_tables = 1.0 if len(page.get_drawings()) >= TABLE_DRAWINGS else 0.0
+    score = (
+        PRIORITY_WEIGHTS['text_density'] * text_density
+        + PRIORITY_WEIGHTS['figures'] * has_figures
+        + PRIORITY_WEIGHTS['tables'] * has_tables
+    )
+    # Pénalise les pages de début et de fin de document
+    edge = max(1, math.ceil(total_pages * EDGE_FRACTION))
+    if page_num < edge or page_num >= total_pages - edge:
+        score *= EDGE_PENALTY
+    return score
+
+
+def score_pages(pdf_folder: str, pages: Iterable[Tuple[str, int]]) -> Dict[Tuple[str, int], float]:
+    """Calcule le score de priorité de chaque page (pdf_file, page_num), en ouvrant chaque PDF une seule fois."""
+    pages_by_pdf = {}
+    for pdf_file, page_num in pages:
+        pages_by_pdf.setdefault(pdf_file, []).append(page_num)
+    scores = {}
+    for pdf_file, page_numbers in pages_by_pdf.items():
+        try:
+            with fitz.open(os.path.join(pdf_folder, pdf_file)) as pdf_document:
+                total_pages = pdf_document.page_count
+                for page_num in page_numbers:
+                    try:
+                        scores[(pdf_file, page_num)] = page_priority_score(pdf_document[page_num], page_num, total_pages)
+                    except Exception as e:
+                        print(f"Error scoring page {page_num} of {pdf_file}: {str(e)}")
+                        scores[(pdf_file, page_num)] = 0.0
+        except Exception as e:
+            print(f"Error reading {pdf_file}: {str(e)}")
+            for page_num in page_numbers:
+                scores[(pdf_file, page_num)] = 0.0
+    return scores
+
+
+def prioritize_pages(
+    scores: Dict[Tuple[str, int], float],
+    temperature: float = 0.0,
+    seed: Optional[int] = None
+) -> List[Tuple[str, int]]:
+    """
+    Ordonne les pages par priorité décroissante.
+    Avec `temperature` > 0, l'ordre est tiré aléatoirement (Gumbel-top-k) : plus la température
+    est élevée, plus l'ordre se rapproche d'un tirage uniforme, ce qui préserve la diversité.
+    """
+    if temperature <= 0:
+        return sorted(scores, key=lambda page: scores[page], reverse=True)
+    rng = random.Random(seed)
+    keys = {
+        page: score / temperature - math.log(-math.log(rng.random() or 1e-12))
+        for page, score in scores.items()
+    }
+    return sorted(keys, key=lambda page: keys[page], reverse=True)
+
+
+def iter_prioritized_pages(
+    pdf_folder: str,
+    page_stream: Iterable[Tuple[str, int]],
+    window: int = 200,
+    temperature: float = 0.0,
+    seed: Optional[int] = None
+) -> Iterator[Tuple[str, int]]:
+    """Réordonne un flux de pages par fenêtres de `window` pages, sans tout scorer à l'avance."""
+    page_stream = iter(page_stream)
+    rng = random.Random(seed)
+    while True:
+        batch = [page for _, page in zip(range(window), page_stream)]
+        if not batch:
+            return
+        yield from prioritize_pages(score_pages(pdf_folder, batch), temperature, rng.random())
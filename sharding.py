@@ -0,0 +1,111 @@
+#sharding.py
+import os
+import json
+import hashlib
+import argparse
+from typing import Dict, List, Tuple
+
+REQUIRED_KEYS = ("pdf_name", "page_number", "queries", "error")
+
+
+def shard_of(pdf_name: str, page_number: int, shard_count: int, seed: int = 0) -> int:
+    """Shard d'un élément (pdf, page), stable d'une machine et d'un processus à l'autre."""
+    digest = hashlib.sha256(f"{seed}:{pdf_name}:{page_number}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+
+def filter_shard(
+    pages: Dict[str, List[int]],
+    shard_index: int,
+    shard_count: int,
+    seed: int = 0
+) -> Dict[str, List[int]]:
+    """Ne garde que les pages appartenant au shard `shard_index`."""
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard index {shard_index} for {shard_count} shards")
+    shard_pages = {}
+    for pdf_name, page_numbers in pages.items():
+        kept = [p for p in page_numbers if shard_of(pdf_name, p, shard_count, seed) == shard_index]
+        if kept:
+            shard_pages[pdf_name] = kept
+    return shard_pages
+
+
+def shard_output_path(output_path: str, shard_index: int, shard_count: int) -> str:
+    # ex: results.jsonl -> results.shard-00002-of-00008.jsonl
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.shard-{shard_index:05d}-of-{shard_count:05d}{ext}"
+
+
+def _is_valid_record(record: Dict) -> bool:
+    if not isinstance(record, dict) or any(key not in record for key in REQUIRED_KEYS):
+        return False
+    if not isinstance(record["pdf_name"], str) or not record["pdf_name"]:
+        return False
+    if not isinstance(record["page_number"], int):
+        return False
+    # Une ligne sans erreur doit contenir des requêtes
+    return record["error"] is not None or isinstance(record["queries"], dict)
+
+
+def merge_shards(shard_paths: List[str], output_path: str) -> Dict[str, int]:
+    """
+    Fusionne les fichiers JSONL des shards en un seul fichier.
+    Les doublons (pdf_name, page_number) sont dédupliqués en préférant un résultat sans erreur,
+    les lignes invalides sont écartées et la sortie est triée par (pdf_name, page_number).
+    """
+    merged: Dict[Tuple[str, int], Dict] = {}
+    stats = {"records": 0, "invalid": 0, "duplicates": 0, "errors": 0, "written": 0}
+    for shard_path in shard_paths:
+        if not os.path.exists(shard_path):
+            print(f"Warning: shard not found: {shard_path}")
+            continue
+        with open(shard_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    stats["invalid"] += 1
+                    continue
+                if not _is_valid_record(record):
+                    stats["invalid"] += 1
+                    continue
+                stats["records"] += 1
+                key = (record["pdf_name"], record["page_number"])
+                existing = merged.get(key)
+                if existing is not None:
+                    stats["duplicates"] += 1
+                    if existing["error"] is None or record["error"] is not None:
+                        continue
+                merged[key] = record
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for key in sorted(merged):
+            record = merged[key]
+            if record["error"] is not None:
+                stats["errors"] += 1
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            stats["written"] += 1
+
+    print(f"Merged {len(shard_paths)} shards into {output_path}: "
+          f"{stats['written']} records ({stats['errors']} with errors), "
+          f"{stats['duplicates']} duplicates, {stats['invalid']} invalid lines")
+    return stats
+
+
+def find_shard_paths(output_path: str, shard_count: int) -> List[str]:
+    return [shard_output_path(output_path, i, shard_count) for i in range(shard_count)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fusionne les sorties JSONL des shards de génération")
+    parser.add_argument("output", help="Fichier JSONL fusionné")
+    parser.add_argument("shards", nargs="*", help="Fichiers JSONL des shards")
+    parser.add_argument("--shard-count", type=int, default=None,
+                        help="Déduit les chemins des shards à partir de la sortie (results.shard-XXXXX-of-YYYYY.jsonl)")
+    args = parser.parse_args()
+    shard_paths = args.shards or find_shard_paths(args.output, args.shard_count or 1)
+    merge_shards(shard_paths, args.output)
@@ -4,7 +4,12 @@ import time
 from collections import deque
 import aiofiles
 import json
-from typing import Dict, List, Any, Optional,Callable,TypeVar
+import math
+import weakref
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from config import RENDER_EXECUTOR, RENDER_WORKERS, RENDER_QUEUE_SIZE
+from typing import Dict, List, Any, Optional,Callable,TypeVar,Iterable
 
 T = TypeVar('T')
 
@@ -51,6 +56,169 @@ class RateLimiter:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         pass
 
+class TargetTracker:
+    """
+    Suit le nombre de requêtes valides acceptées (au total ou par groupe : langue, PDF...)
+    et le taux de pages valides observé, pour savoir combien de pages lancer en avance.
+    """
+    def __init__(self, target: int, groups: Optional[Iterable] = None, combine: str = 'max'):
+        self.target = target
+        self.counts = {group: 0 for group in groups} if groups is not None else {None: 0}
+        self.combine = combine  # 'max' si une page crédite tous les groupes à la fois, 'sum' sinon
+        self.processed_pages = 0
+        self.valid_pages = 0
+
+    def add_group(self, group):
+        self.counts.setdefault(group, 0)
+
+    def is_open(self, group) -> bool:
+        return self.counts.get(group, self.target) < self.target
+
+    def record(self, accepted_groups: Iterable) -> int:
+        """Enregistre une page traitée et retourne le nombre de requêtes acceptées."""
+        self.processed_pages += 1
+        accepted = 0
+        for group in accepted_groups:
+            if self.is_open(group):
+                self.counts[group] += 1
+                accepted += 1
+        if accepted:
+            self.valid_pages += 1
+        return accepted
+
+    @property
+    def done(self) -> bool:
+        return all(count >= self.target for count in self.counts.values())
+
+    @property
+    def valid_rate(self) -> float:
+        # Estimation lissée (Laplace) pour éviter 0 ou 1 en début de run
+        return (self.valid_pages + 1) / (self.processed_pages + 2)
+
+    def remaining(self) -> int:
+        missing = [max(0, self.target - count) for count in self.counts.values()]
+        return sum(missing) if self.combine == 'sum' else max(missing, default=0)
+
+    def pages_to_dispatch(self, in_flight: int, max_in_flight: int) -> int:
+        needed = math.ceil(self.remaining() / self.valid_rate) - in_flight
+        return max(0, min(needed, max_in_flight - in_flight))
+
+    def summary(self) -> str:
+        counts = ", ".join(f"{group}: {count}" for group, count in self.counts.items() if group is not None)
+        total = sum(self.counts.values())
+        return (f"{total} valid queries accepted from {self.processed_pages} pages "
+                f"(valid rate {self.valid_rate:.2f})" + (f" [{counts}]" if counts else ""))
+
+
+class ByteBudget:
+    """
+    Budget global d'octets en mémoire (images rendues en attente de réponse de l'API).
+    `acquire` bloque tant que le budget est dépassé et `release` libère les octets une fois la requête terminée.
+    Une réservation est toujours accordée s'il n'y en a aucune autre en cours, pour garantir la progression.
+    """
+    def __init__(self, max_bytes: int, default_estimate: int = 512 * 1024):
+        self.max_bytes = max_bytes
+        self.default_estimate = default_estimate
+        self.in_use = 0
+        self.peak = 0
+        self._holders = 0
+        self._observed_bytes = 0
+        self._observed_count = 0
+        self._condition = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def estimate(self) -> int:
+        """Taille attendue d'une image, d'après les images déjà rendues."""
+        if self._observed_count == 0:
+            return self.default_estimate
+        return self._observed_bytes // self._observed_count
+
+    def _add(self, nbytes: int):
+        self.in_use += nbytes
+        self.peak = max(self.peak, self.in_use)
+
+    async def acquire(self, nbytes: int) -> int:
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self._holders == 0 or self.in_use + nbytes <= self.max_bytes)
+            self._holders += 1
+            self._add(nbytes)
+        return nbytes
+
+    async def adjust(self, reserved: int, actual: int) -> int:
+        """Remplace une réservation estimée par la taille réelle, sans bloquer."""
+        condition = self._get_condition()
+        async with condition:
+            self._observed_bytes += actual
+            self._observed_count += 1
+            self._add(actual - reserved)
+            condition.notify_all()
+        return actual
+
+    async def charge(self, nbytes: int) -> int:
+        """Compte des octets sans attendre (ex: image de contexte d'un PDF déjà admis)."""
+        async with self._get_condition():
+            self._add(nbytes)
+        return nbytes
+
+    async def release(self, nbytes: int, held: bool = True):
+        condition = self._get_condition()
+        async with condition:
+            self.in_use -= nbytes
+            if held:
+                self._holders -= 1
+            condition.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        return {"current_bytes": self.in_use, "peak_bytes": self.peak, "max_bytes": self.max_bytes}
+
+
+class BlockingExecutor:
+    """
+    Exécute le travail CPU (rendu PDF, encodage) hors de la boucle asyncio.
+    Le nombre de travaux soumis est borné pour ne pas accumuler de rendus en attente.
+    """
+    def __init__(self, kind: str = RENDER_EXECUTOR, max_workers: int = RENDER_WORKERS, max_pending: int = RENDER_QUEUE_SIZE):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._semaphores = weakref.WeakKeyDictionary()  # Un sémaphore par boucle d'événements
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="render")
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_pending)
+        async with semaphore:
+            return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+render_executor = BlockingExecutor()
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Exécute `func` dans l'executor de rendu partagé (fonction picklable en mode processus)."""
+    return await render_executor.run(func, *args, **kwargs)
+
+
 async def process_with_retry(func: Callable[..., T], *args: Any, max_retries: int = 3, base_delay: int = 3) -> T:
     for attempt in range(max_retries):
         try:
@@ -1,10 +1,21 @@
+import os
+import sys
 import pandas as pd
 import base64
+import torch
+import numpy as np
 from io import BytesIO
 from PIL import Image
 from datasets import load_dataset
 from mcdse import MCDSEModel
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_store import get_default_store, image_key, cached_embeddings
+from ann_index import IVFFlatIndex
+from config import RETRIEVAL_SEARCH
+
+SEARCH = RETRIEVAL_SEARCH  # "exact" : similarité avec tout le benchmark ; "ann" : index IVF sur le benchmark
+
 # --------------------------------------------------------
 # 1. Charger TOUT le corpus
 # --------------------------------------------------------
@@ -31,9 +42,30 @@ model = MCDSEModel(
     device="cpu"
 )
 
+# Les embeddings sont conservés dans le store local : une image déjà encodée
+# par le même modèle (mêmes pixels) n'est pas réencodée lors d'un nouveau passage
+# Les vecteurs aléatoires du mode fake ne sont jamais stockés : ils pourraient être relus comme de vrais embeddings
+model_id = f"mcdse:{model.model_path}:{model.dimension}"
+store = None if model.use_fake else get_default_store(model_id)
+
+def pixel_bytes(img):
+    # Même source d'octets pour le benchmark et le corpus : les pixels RGB décodés (et la taille),
+    # pour qu'une même image ait la même clé quel que soit son encodage d'origine
+    rgb = img.convert("RGB")
+    return f"{rgb.width}x{rgb.height}:".encode() + rgb.tobytes()
+
+def encode_images_cached(images):
+    keys = [image_key(model_id, pixel_bytes(img)) for img in images]
+    embeddings = cached_embeddings(
+        store, keys,
+        lambda missing: list(model.fake_encode_documents([images[i] for i in missing]).float().numpy())
+    )
+    return torch.from_numpy(np.stack(embeddings))
+
 # Générer les embeddings du benchmark une seule fois
 print("Encodage du benchmark...")
-benchmark_embeddings = model.fake_encode_documents(benchmark_images)
+benchmark_embeddings = encode_images_cached(benchmark_images)
+benchmark_index = IVFFlatIndex().build(benchmark_embeddings.numpy()) if SEARCH == "ann" else None
 
 # --------------------------------------------------------
 # 4. Traiter le corpus par lots
@@ -49,15 +81,20 @@ for batch_start in range(0, len(corpus_df), BATCH_SIZE):
     
     # Conversion et encodage par lot
     batch_images = [base64_to_image(img) for img in batch_df["image"]]
-    batch_embeddings = model.fake_encode_documents(batch_images)
+    batch_embeddings = encode_images_cached(batch_images)
     
-    # Calcul de similarité avec le benchmark
-    batch_similarities = model.compute_similarity(batch_embeddings, benchmark_embeddings)
+    # Meilleure image du benchmark pour chaque image du lot
+    if benchmark_index is not None:
+        best_ids, best_scores = benchmark_index.search(batch_embeddings.numpy(), 1)
+    else:
+        batch_similarities = model.compute_similarity(batch_embeddings, benchmark_embeddings)
+        best_scores, best_ids = batch_similarities.max(dim=1, keepdim=True)
+        best_ids, best_scores = best_ids.numpy(), best_scores.numpy()
     
     # Stockage des résultats
     for i, (idx, row) in enumerate(batch_df.iterrows()):
-        best_match_idx = batch_similarities[i].argmax().item()
-        best_score = batch_similarities[i][best_match_idx].item()
+        best_match_idx = int(best_ids[i][0])
+        best_score = float(best_scores[i][0])
         
         results.append({
             "docid": row["docid"],